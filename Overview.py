@@ -1,55 +1,54 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import altair as alt
 import datetime
-import time
-from tools import create_sankey
+from tools import create_sankey, comment_timestamp
+from comments import add_comment, read_comments
+from data_access import load_table, table_version
+from instrument import start_rerun, finish_rerun, stage
 
 # Set the page configuration to wide layout
 st.set_page_config(layout="wide")
-comment_table = pd.read_csv("./data/club_overview_comment.csv")
-
-
-# Caching the data loading function to improve performance
-@st.cache_data
-def load_data(file_path):
-    df = pd.read_csv(file_path)
-    
-    # Calculate attendance by counting the number of unique players per team per day
-    attendance_df = df.dropna().groupby(['Team Name', 'Year', 'Week'])['Player'].nunique().reset_index()
-    attendance_df.rename(columns={'Player': 'Attendance'}, inplace=True)
-    
-    # Calculate the average duration and median attendance per team per week
-    agg_df = df.dropna().groupby(['Team Name', 'Year', 'Week']).agg({
-        'Duration': 'mean',
-        "Total Distance(m)": 'mean',
-        "Total Player Load": 'mean',
-        "High Intensity Distance(m)": 'max',
-        "Sprint Distance(m)": 'max',
-        'Player': 'nunique',
-        "Load Per Minute": 'mean',
-        "Distance Per Minute": 'mean', 
-        "Acc-Dec-COD Per Minute": 'mean'
-    }).rename(columns={'Player': 'Attendance'}).reset_index().round(2)
-    
-    # Calculate average attendance for each team during the entire lifecycle
-    avg_attendance = agg_df.groupby('Team Name')['Attendance'].mean().reset_index()
-    avg_attendance.rename(columns={'Attendance': 'Avg Attendance'}, inplace=True)
-    
-    # Merge average attendance back into the aggregated DataFrame
-    agg_df = agg_df.merge(avg_attendance, on='Team Name')
-    
-    # Filter based on the condition
-    # agg_df['Duration'] = agg_df.apply(lambda row: 0 if row['Attendance'] < 0.25 * row['Avg Attendance'] else row['Duration'], axis=1)
-    # agg_df['Attendance'] = agg_df.apply(lambda row: 0 if row['Attendance'] < 0.25 * row['Avg Attendance'] else row['Attendance'], axis=1)
-    
-    # Create a new 'Date' column representing the first day of the week
-    agg_df['Date'] = pd.to_datetime(agg_df['Year'].astype(str) + agg_df['Week'].astype(str) + '1', format='%G%V%u') + pd.offsets.Week(weekday=0)
-    
-    return agg_df
-
-agg_df = load_data('./data/df_all.csv')
-df_all = pd.read_csv('./data/df_all.csv', parse_dates=["Date"], date_format='%Y-%m-%d')
+start_rerun("Overview")
+
+
+# Only the columns used on this page are read from the store, from the
+# rows without a missing value the page has always kept
+overview_columns = ["Date", "Player", "Position", "Team Name", "Year", "Week", "Duration",
+                    "Total Distance(m)", "Total Player Load", "High Intensity Distance(m)",
+                    "Sprint Distance(m)", "Maximum Velocity(m/s)", "Load Per Minute",
+                    "Distance Per Minute", "Acc-Dec-COD Per Minute"]
+
+# Leaderboard of one metric: the top rows first, then the last 30 days of
+# those players only, cut out of one player-sorted array. Cached per
+# selection so going back to a metric costs nothing.
+@st.cache_data(max_entries=64)
+def load_leaderboard(metric, dates, teams, positions, version, top=10):
+    df = load_table("df_all", columns=overview_columns, dropna=True)
+    df = df[(df['Team Name'].isin(teams)) &
+            (df['Position'].isin(positions)) &
+            (df['Date'] >= pd.to_datetime(dates[0])) &
+            (df['Date'] <= pd.to_datetime(dates[1]))].dropna()
+    rank_df = df[["Player", "Team Name", "Position", "Date", metric]].sort_values("Date").round(2).dropna()
+    top_df = rank_df.sort_values(metric, ascending=False).head(top)
+
+    last_30_days_start = rank_df['Date'].max() - datetime.timedelta(days=30)
+    last_30_days_df = rank_df[(rank_df['Date'] >= last_30_days_start) &
+                              (rank_df['Date'] >= pd.to_datetime(dates[0])) &
+                              (rank_df['Player'].isin(top_df['Player']))]
+    players = last_30_days_df['Player'].astype(str).to_numpy()
+    order = np.argsort(players, kind='stable')
+    names, starts = np.unique(players[order], return_index=True)
+    values = np.split(last_30_days_df[metric].to_numpy()[order], starts[1:])
+    sparklines = dict(zip(names, (list(x) for x in values)))
+
+    top_df['Last 30 Days'] = top_df['Player'].astype(str).map(sparklines)
+    return top_df
+
+# Weekly team figures come ready-made from the pre-processing
+agg_df = load_table("df_week_overview")
+df_all = load_table("df_all", columns=overview_columns, dropna=True)
 
 
 st.sidebar.markdown("# Overview")
@@ -70,15 +69,16 @@ selected_position = st.sidebar.multiselect('Position', df_all["Position"].unique
 
 
 # Filter the data based on selections
-filtered_df = agg_df[
-    (agg_df['Team Name'].isin(selected_teams)) &
-    (agg_df['Date'] >= pd.to_datetime(selected_dates[0])) &
-    (agg_df['Date'] <= pd.to_datetime(selected_dates[1]))].dropna()
+with stage("filter selection"):
+    filtered_df = agg_df[
+        (agg_df['Team Name'].isin(selected_teams)) &
+        (agg_df['Date'] >= pd.to_datetime(selected_dates[0])) &
+        (agg_df['Date'] <= pd.to_datetime(selected_dates[1]))].dropna()
 
-filtered_all = df_all[(df_all['Team Name'].isin(selected_teams)) &
-                      (df_all['Position'].isin(selected_position)) &
-    (df_all['Date'] >= pd.to_datetime(selected_dates[0])) &
-    (df_all['Date'] <= pd.to_datetime(selected_dates[1]))].dropna()
+    filtered_all = df_all[(df_all['Team Name'].isin(selected_teams)) &
+                          (df_all['Position'].isin(selected_position)) &
+        (df_all['Date'] >= pd.to_datetime(selected_dates[0])) &
+        (df_all['Date'] <= pd.to_datetime(selected_dates[1]))].dropna()
 
 st.markdown(f"# Club Performance Overview ({selected_dates[0]} to {selected_dates[1]})")
 overall_cols = ["Attendance", "Total Distance(m)", "Total Player Load","Duration", 
@@ -91,18 +91,14 @@ rank_cols = ["Maximum Velocity(m/s)",  "High Intensity Distance(m)", "Sprint Dis
 rank, overview = st.columns(2)
 
 # Create the Gantt chart per duration
-with rank:
+with rank, stage("rank charts"):
     selected_metric = st.selectbox('Session Metric', rank_cols)
-    rank_df = filtered_all[["Player", "Team Name", "Position", "Date", selected_metric]].sort_values("Date").round(2).dropna()
-    last_30_days_start = rank_df['Date'].max() - datetime.timedelta(days=30)
-    last_30_days_df = rank_df[(rank_df['Date'] >= last_30_days_start) &
-                              (rank_df['Date'] >= pd.to_datetime(selected_dates[0])) 
-                              ]
-    last_30_days_array = last_30_days_df.groupby('Player').apply(lambda x: list(x[selected_metric])).reset_index(name='Last 30 Days')
-    rank_df = rank_df.merge(last_30_days_array, on='Player', how='left')
+    with stage("aggregate leaderboard"):
+        rank_df = load_leaderboard(selected_metric, selected_dates, selected_teams, selected_position,
+                                   table_version("df_all"))
 
     st.write(f'## {selected_metric} Leaderboard')
-    st.dataframe(rank_df.sort_values(selected_metric, ascending=False).head(10), 
+    st.dataframe(rank_df, 
                  hide_index=True,
                  use_container_width = True,
                  column_config = { "Date": st.column_config.DateColumn(format = 'Y-MM-DD'),
@@ -111,7 +107,7 @@ with rank:
                  )
     # Group by Position and calculate the average of selected metrics
     st.write(f'## Avg {selected_metric} by Position')
-    avg_metric_by_position = filtered_all.groupby('Position')[selected_metric].mean().reset_index().round(2)
+    avg_metric_by_position = filtered_all.groupby('Position', observed=True)[selected_metric].mean().reset_index().round(2)
 
     bars = alt.Chart(avg_metric_by_position).mark_bar().encode(
         x=alt.X('Position:N', title='Position', sort='-y'),
@@ -133,7 +129,7 @@ with rank:
 
     # Group by team and calculate the average of selected metrics
     st.write(f'## Avg {selected_metric} by Team')
-    avg_metric_by_position = filtered_all.groupby('Team Name')[selected_metric].mean().reset_index().round(2)
+    avg_metric_by_position = filtered_all.groupby('Team Name', observed=True)[selected_metric].mean().reset_index().round(2)
 
     bars = alt.Chart(avg_metric_by_position).mark_bar().encode(
         x=alt.X('Team Name:N', title='Team', sort='-y'),
@@ -153,7 +149,7 @@ with rank:
     )
     st.altair_chart(bar_chart, use_container_width=True)
 
-with overview:
+with overview, stage("overview charts"):
     selected_metric = st.selectbox('Session Metric', overall_cols)
     st.write(f'## Weekly {selected_metric} Per Team')
     gantt_chart = alt.Chart(filtered_df).mark_bar().encode(
@@ -184,8 +180,9 @@ with overview:
 
 
 
-with st.container():
+with st.container(), stage("comments"):
     st.markdown("**Comment:**")
+    comment_table = read_comments("club_overview")
     comment_list = (comment_table["User"] + ": " + comment_table["Comment"]).values
     if len(comment_list)==0:
         st.markdown("Ask performance team for further advice.")
@@ -205,12 +202,7 @@ with st.container():
     user = st.text_input('Your Name', '')
     comment = st.text_area('Comment:', '')
     if st.button('Submit'):
-
-        ts = time.time()
-        now = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-        new_row = pd.DataFrame({'Timestamp': [now],'User':user, 'Comment': [comment]})
-        comment_table = pd.concat([comment_table, new_row], ignore_index=True)
-        comment_table.to_csv("./data/club_overview_comment.csv", encoding='utf-8', index=False)
+        add_comment("club_overview", comment_timestamp(), user, comment)
         # reset comments
         comment = ""
         user = ""
@@ -223,4 +215,6 @@ st.markdown("""
     - Total Player Load: The average workload on players.
     - High Intensity Distance (m): The peak distance at high intensity.
     - Sprint Distance (m): The longest sprint distance.
-""")
\ No newline at end of file
+""")
+
+finish_rerun()
@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+
+# The ACWR is the ratio between how much workload has been done
+# in the last 7 days (acute workload) versus
+# the average weekly workload that has been performed
+# over the previous 21 days (chronic workload).
+# Calculated by Exponentially Weighted Moving Average
+# https://support.catapultsports.com/hc/en-us/articles/360000538795-How-to-Set-Up-an-Acute-Chronic-Workload-Ratio-Chart
+#
+# pandas' ewm(adjust=True).mean() walks a series keeping three numbers: the
+# current weighted mean, the total weight of the past observations and the
+# observation count. Instead of running that walk once per player and per
+# metric, the engine below advances it for every player and every
+# (metric, span) column at once: step t updates the t-th row of each player.
+#
+# Rest days need no rows of their own. Each row can carry the step it takes
+# in the walk (e.g. its day number) and the past weight then decays once per
+# step since the player's previous row, exactly as if the rows in between
+# had been there without an observation.
+
+
+def decay_factor(span):
+    # Same span -> alpha conversion as pandas
+    com = (span - 1) / 2.0
+    return 1.0 - 1.0 / (1.0 + com)
+
+
+def init_ewma_state(n_cols, groups=()):
+    # Running EWMA state of every (group, column): the weighted mean, the
+    # total weight of past observations and the observation count, plus the
+    # last step walked by every group
+    groups = pd.Index(groups)
+    return {
+        "groups": groups,
+        "weighted": np.full((len(groups), n_cols), np.nan),
+        "old_wt": np.ones((len(groups), n_cols)),
+        "nobs": np.zeros((len(groups), n_cols), dtype=np.int64),
+        "last_step": np.zeros(len(groups), dtype=np.int64),
+    }
+
+
+def extend_ewma_state(state, groups):
+    # Add fresh rows for groups the state has not seen yet and return the
+    # state row of every group
+    groups = pd.Index(groups)
+    new_groups = groups[~groups.isin(state["groups"])]
+    if len(new_groups):
+        fresh = init_ewma_state(state["weighted"].shape[1], new_groups)
+        for key in ("weighted", "old_wt", "nobs", "last_step"):
+            state[key] = np.concatenate([state[key], fresh[key]])
+        state["groups"] = state["groups"].append(new_groups)
+    return state["groups"].get_indexer(groups)
+
+
+def concat_ewma_states(states, groups=None):
+    # One state from the states of disjoint sets of groups, rows optionally
+    # in the order of the given groups
+    state = {key: np.concatenate([part[key] for part in states])
+             for key in ("weighted", "old_wt", "nobs", "last_step")}
+    state["groups"] = pd.Index(np.concatenate([np.asarray(part["groups"], dtype=object) for part in states]))
+    if groups is not None:
+        rows = state["groups"].get_indexer(pd.Index(groups))
+        state = {key: value[rows] for key, value in state.items()}
+    return state
+
+
+def grouped_ewma(values, codes, factors, state, steps=None):
+    # values: (rows, cols) array, rows already in walk order within each group
+    # codes: group code of every row
+    # factors: decay factor of every column
+    # state: running EWMA state, see init_ewma_state, updated in place
+    # steps: walk step of every row, increasing within each group; without
+    #        it every row is the next step of its group
+    out = np.full(values.shape, np.nan)
+    if len(codes) == 0:
+        return out
+
+    # Position of each row inside its group, then all rows sharing a position
+    # are laid out contiguously so every step is one slice.
+    position = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+    step_order = np.lexsort((codes, position))
+    bounds = np.searchsorted(position[step_order], np.arange(position.max() + 2))
+
+    weighted, old_wt, nobs, last_step = state["weighted"], state["old_wt"], state["nobs"], state["last_step"]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        rows = step_order[start:end]
+        groups = codes[rows]
+        cur = values[rows]
+        w = weighted[groups]
+        ow = old_wt[groups]
+
+        if steps is None:
+            decay = factors
+            last_step[groups] += 1
+        else:
+            # One decay per step skipped since the group's previous row
+            decay = factors ** (steps[rows] - last_step[groups])[:, None]
+            last_step[groups] = steps[rows]
+
+        is_observation = cur == cur
+        has_mean = w == w
+        ow = np.where(has_mean, ow * decay, ow)
+        with np.errstate(invalid="ignore"):
+            blended = np.where(w != cur, (ow * w + cur) / (ow + 1.0), w)
+        update = has_mean & is_observation
+        w = np.where(update, blended, np.where(is_observation, cur, w))
+        ow = np.where(update, ow + 1.0, ow)
+
+        weighted[groups] = w
+        old_wt[groups] = ow
+        nobs[groups] += is_observation
+        out[rows] = w
+
+    return out
+
+
+def group_codes(df, group):
+    # The weekly table still carries Player in its index at this point
+    keys = df[group] if group in df.columns else df.index.get_level_values(group)
+    return pd.factorize(keys)
+
+
+def calc_ewma_acwr(df, metrics, acute_days=7, chronic_days=21, group="Player", state=None, steps=None):
+    # One grouped pass for every metric: acute and chronic EWMAs are computed
+    # side by side as the two halves of a (rows, 2 * metrics) array, rows are
+    # walked in frame order within each player like groupby().transform().
+    # Passing a state dict carries the walk on from an earlier call (an empty
+    # dict starts a new one) and leaves the final state in it. Passing the
+    # walk step of every row (see grouped_ewma) lets df hold sessions only.
+    codes, uniques = group_codes(df, group)
+    values = df[metrics].to_numpy(dtype=float)
+    n_metrics = len(metrics)
+
+    if state is None:
+        state = {}
+    if not state:
+        state.update(init_ewma_state(2 * n_metrics))
+    rows = extend_ewma_state(state, uniques)
+
+    factors = np.repeat([decay_factor(acute_days), decay_factor(chronic_days)], n_metrics)
+    steps = None if steps is None else np.asarray(steps, dtype=np.int64)
+    ewma = grouped_ewma(np.hstack([values, values]), rows[codes], factors, state, steps)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acwr = np.round(ewma[:, :n_metrics] / ewma[:, n_metrics:], 2)
+    df[[f"{metric} EWMA ACWR" for metric in metrics]] = acwr
+
+    return df
+
+
+# Rolling averages: the acute load is the daily average over the last
+# acute_days, the chronic load the daily average over the last chronic_days
+# (coupled) or over the days before the acute window (uncoupled). Monotony
+# is the daily average over the acute window divided by its standard
+# deviation, strain the window's total times its monotony. Rest days count
+# as days without load.
+#
+# Each group's rows are summed per day into one array sorted by (group,
+# day), and the days of every trailing window are found by binary search
+# and added up, for every group and column at once. A window needs
+# min_periods days with an observation, like the min_periods of pandas'
+# time-based rolling windows.
+
+rolling_figures = ["Coupled ACWR", "Uncoupled ACWR", "Monotony", "Strain"]
+
+
+def daily_totals(values, keys):
+    # Summed values and observed days (1 or 0 per column) of every key
+    # (group, day): the sorted keys, their rows and the key of every row
+    keys, rows = np.unique(keys, return_inverse=True)
+    order = np.argsort(rows, kind="stable")
+    starts = np.searchsorted(rows[order], np.arange(len(keys)))
+    observed = values == values
+    totals = np.add.reduceat(np.where(observed, values, 0.0)[order], starts)
+    days_observed = np.add.reduceat(observed[order], starts) > 0
+    return keys, totals, days_observed.astype(np.int64), rows
+
+
+def window_sums(keys, values, acute_days, chronic_days):
+    # Sums of the values of the keys in (key - acute_days, key] and in
+    # (key - chronic_days, key - acute_days] for every key, added up day by
+    # day from the oldest so a sum only depends on the days of its window.
+    # The day of every offset is found by binary search in the sorted keys;
+    # the keys of a group must stay more than chronic_days above the keys of
+    # the group before
+    acute, before = np.zeros(values.shape), np.zeros(values.shape)
+    for offset in range(chronic_days - 1, -1, -1):
+        position = np.minimum(np.searchsorted(keys, keys - offset), len(keys) - 1)
+        hit = np.flatnonzero(keys[position] == keys - offset)
+        window = acute if offset < acute_days else before
+        window[hit] += values[position[hit]]
+    return acute, before
+
+
+def calc_rolling_loads(df, metrics, acute_days=7, chronic_days=28, min_periods=3, group="Player", date="Date"):
+    # Coupled and uncoupled rolling ACWR, monotony and strain of every metric
+    # in one pass over the groups' daily totals; a row gets the figures of
+    # its group and day
+    names = [f"{metric} {figure}" for figure in rolling_figures for metric in metrics]
+    if df.empty:
+        df[names] = np.nan
+        return df
+    codes, _ = group_codes(df, group)
+    days = (df[date] - df[date].min()).dt.days.to_numpy()
+    span = days.max() + chronic_days + 1
+    keys, totals, observed, rows = daily_totals(df[metrics].to_numpy(dtype=float), codes * span + days)
+
+    # Sums, sums of squares and observed days of the acute window and of
+    # the days before it in the chronic window
+    n = len(metrics)
+    daily = np.hstack([totals, totals ** 2, observed])
+    acute, before = window_sums(keys, daily, acute_days, chronic_days)
+    acute_sum, acute_squares, acute_days_observed = acute[:, :n], acute[:, n:2 * n], acute[:, 2 * n:]
+    before_sum, before_days_observed = before[:, :n], before[:, 2 * n:]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        acute_load = acute_sum / acute_days
+        coupled = acute_load / ((acute_sum + before_sum) / chronic_days)
+        uncoupled = acute_load / (before_sum / (chronic_days - acute_days))
+        variance = np.maximum(acute_squares - acute_sum ** 2 / acute_days, 0) / (acute_days - 1)
+        monotony = acute_load / np.sqrt(variance)
+        strain = acute_sum * monotony
+    coupled[acute_days_observed + before_days_observed < min_periods] = np.nan
+    uncoupled[before_days_observed < min_periods] = np.nan
+    monotony[acute_days_observed < min_periods] = np.nan
+    strain[acute_days_observed < min_periods] = np.nan
+
+    figures = np.round(np.hstack([coupled, uncoupled, monotony, strain]), 2)
+    df[names] = figures[rows]
+    return df
@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from instrument import record, stage
+from pipeline import Pipeline, stages
+from transforms import seasons, raw_columns
+
+# Benchmark of the pre-processing pipeline on synthetic data.
+#
+# A GPS export in the anonymous.csv schema is generated for a number of
+# teams, players and seasons, then run through the stages of pipeline.py one
+# at a time. Every stage, and every instrument.stage inside it, is recorded
+# with its time and change of resident memory; the result is written as
+# JSON so runs at different sizes (or before and after a change) can be
+# compared:
+#
+#   python bench.py --teams 8 --players 40 --seasons 2 --output bench.json
+#   python bench.py --input ./data/anonymous.csv
+#
+# The stages run in process (one worker) unless --workers is given. With one
+# worker the daily stage also lists the steps of transforms.enrich_daily
+# (intensity, imbalance, acwr and flags_risk); the steps run in the worker
+# processes otherwise and are not recorded. --tracemalloc also reports the
+# peak of the Python allocations of the run, which slows it down.
+
+positions = np.array(['Central Midfielder', 'Centre Back', 'Attacker', 'Winger', 'Full Back', 'Goal Keeper'],
+                     dtype=object)
+position_weights = [0.24, 0.21, 0.19, 0.14, 0.13, 0.09]
+
+# Chance of a team session on each day of the week, Monday first
+session_days = np.array([0.8, 0.8, 0.7, 0.8, 0.6, 0.5, 0.1])
+ATTENDANCE = 0.85
+
+
+def season_table(first_year, n_seasons):
+    # Seasons table in the transforms.seasons format, July to June
+    return {f"{year}/{(year + 1) % 100:02d}": (f"{year}-07-01", f"{year + 1}-06-30")
+            for year in range(first_year, first_year + n_seasons)}
+
+
+def synthetic_sessions(dates, teams, players, rng):
+    # One row per player and session: every team trains on a random set of
+    # days, each of its players turns up with the ATTENDANCE chance
+    n_teams, n_players = len(teams), len(players) // len(teams)
+    trains = rng.random((n_teams, len(dates))) < session_days[dates.dayofweek.to_numpy()]
+    attends = (rng.random((n_teams, n_players, len(dates))) < ATTENDANCE) & trains[:, None, :]
+    team, player, day = np.nonzero(attends)
+    n = len(day)
+
+    duration = np.round(rng.gamma(4.0, 16.5, n), 0)
+    df = pd.DataFrame({
+        'date': dates[day].strftime('%d/%m/%Y'),
+        'player': players[team * n_players + player],
+        'team_name': teams[team],
+        'duration': duration,
+        'total_distance_m': np.round(duration * rng.normal(78, 15, n).clip(20), 1),
+        'total_player_load': np.round(duration * rng.normal(8.7, 1.5, n).clip(2), 1),
+        'acc_2m_s_s_total_efforts': rng.poisson(duration * 0.23),
+        'acc_3m_s_s_total_efforts': rng.poisson(duration * 0.03),
+        'dec_2m_s_s_total_efforts': rng.poisson(duration * 0.2),
+        'dec_3m_s_s_total_efforts': rng.poisson(duration * 0.06),
+        'high_intensity_distance_m_v5_v6_m': np.round(duration * rng.gamma(2.0, 1.3, n), 1),
+        'sprint_distance_m_m': np.round(np.where(rng.random(n) < 0.5, 0, rng.gamma(1.0, 30, n)), 1),
+        'maximum_velocity_km_h': np.round(rng.normal(25.7, 3.0, n).clip(10, 36), 1),
+        'ima_cod_left': rng.poisson(duration * 0.44),
+        'ima_cod_right': rng.poisson(duration * 0.49),
+    })
+    return df
+
+
+def write_synthetic_export(path, n_teams, n_players, n_seasons, first_year=2021, seed=0):
+    # Write an export of n_teams teams of n_players players each over
+    # n_seasons seasons, a season at a time; returns the seasons table
+    rng = np.random.default_rng(seed)
+    teams = np.array([f"Team{i + 1}" for i in range(n_teams)], dtype=object)
+    players = np.array([f"Player{i + 1}" for i in range(n_teams * n_players)], dtype=object)
+    player_positions = rng.choice(positions, len(players), p=position_weights)
+    table = season_table(first_year, n_seasons)
+    for i, (start, end) in enumerate(table.values()):
+        df = synthetic_sessions(pd.date_range(start, end), teams, players, rng)
+        df['position'] = player_positions[df['player'].str[6:].astype(int) - 1]
+        df[raw_columns].to_csv(path, index=False, header=i == 0, mode='w' if i == 0 else 'a')
+    return table
+
+
+def peak_rss_mb():
+    # High-water mark of the process, in kB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_pipeline(pipeline):
+    # The stages of the pipeline one at a time; returns the row counts
+    results = {}
+    for pipeline_stage in stages:
+        with stage(pipeline_stage.name):
+            results.update(pipeline.run_stage(pipeline_stage, results))
+    return {name: len(results[name]) for name in ['df_all', 'df_week_player', 'df_week_team', 'df_week_overview']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pre-processing pipeline")
+    parser.add_argument('--teams', type=int, default=8)
+    parser.add_argument('--players', type=int, default=40, help="players per team")
+    parser.add_argument('--seasons', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--input', help="benchmark an existing export instead of synthetic data")
+    parser.add_argument('--output', help="JSON result file (default: stdout)")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--tracemalloc', action='store_true', help="also trace the Python allocations")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        raw_path, season_dates, generate_seconds = args.input, seasons, None
+        if raw_path is None:
+            raw_path = os.path.join(work_dir, 'anonymous.csv')
+            generate_start = time.perf_counter()
+            season_dates = write_synthetic_export(raw_path, args.teams, args.players, args.seasons, seed=args.seed)
+            generate_seconds = round(time.perf_counter() - generate_start, 4)
+        raw_rows = sum(len(chunk) for chunk in pd.read_csv(raw_path, usecols=['date'], chunksize=100_000))
+
+        data_dir = os.path.join(work_dir, 'data')
+        pipeline = Pipeline(raw_path, data_dir, os.path.join(data_dir, 'state'), season_dates,
+                            workers=args.workers, cache_dir=None)
+        if args.tracemalloc:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with record() as recorded:
+            rows = run_pipeline(pipeline)
+        total_seconds = round(time.perf_counter() - start, 4)
+        peak_traced_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if args.tracemalloc else None
+        tracemalloc.stop()
+
+    result = {
+        'params': {'teams': args.teams, 'players_per_team': args.players, 'seasons': args.seasons,
+                   'seed': args.seed, 'input': args.input, 'workers': args.workers},
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__,
+                        'numpy': np.__version__, 'platform': platform.platform()},
+        'generate_seconds': generate_seconds,
+        'rows': {'raw': raw_rows, **rows},
+        'stages': recorded,
+        'total_seconds': total_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_traced_mb': peak_traced_mb,
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import hashlib
+import importlib
+import inspect
+import os
+import pickle
+import shutil
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# On-disk cache of the pipeline stage results.
+#
+# A stage's entry is keyed by a hash of its inputs, its settings and the
+# source of the code it runs, so a re-run only recomputes the stages whose
+# key changed and the ones downstream of them. An output's hash is derived
+# from the key of the stage that made it, so the frames themselves are only
+# hashed when they are passed in from outside.
+#
+# Each entry is a directory ./data/cache/<key>/ with one pickle per output,
+# so a later stage can load just the outputs it needs. Reading an entry
+# touches it; once the cache grows past max_bytes the least recently used
+# entries are removed.
+
+CACHE_DIR = "./data/cache"
+CACHE_MAX_BYTES = 512 * 2 ** 20
+
+
+def update_hash(h, value):
+    # Feed a stage input or setting to a hashlib object, by content
+    h.update(type(value).__name__.encode())
+    if isinstance(value, pd.DataFrame):
+        h.update(repr([(column, str(dtype)) for column, dtype in value.dtypes.items()]).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, (pd.Series, pd.Index)):
+        h.update(repr((value.name, str(value.dtype))).encode())
+        h.update(pd.util.hash_pandas_object(value, index=isinstance(value, pd.Series)).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        h.update(repr((value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            update_hash(h, key)
+            update_hash(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(str(len(value)).encode())
+        for item in value:
+            update_hash(h, item)
+    else:
+        h.update(repr(value).encode())
+
+
+def fingerprint(value):
+    h = hashlib.sha256()
+    update_hash(h, value)
+    return h.hexdigest()
+
+
+def file_fingerprint(path, block_size=2 ** 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def module_source(name):
+    return inspect.getsource(importlib.import_module(name))
+
+
+def code_fingerprint(function, modules):
+    # Source of a stage function and of the modules whose code it runs
+    return fingerprint([inspect.getsource(function)] + [module_source(name) for name in modules])
+
+
+class StageCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def has(self, key):
+        return os.path.isdir(self.entry_path(key))
+
+    def load(self, key, name):
+        path = self.entry_path(key)
+        os.utime(path)
+        with open(os.path.join(path, f"{name}.pkl"), "rb") as f:
+            return pickle.load(f)
+
+    def save(self, key, outputs):
+        # Written aside and renamed, so a run stopped halfway leaves no entry
+        path = self.entry_path(key)
+        partial = f"{path}.{os.getpid()}.partial"
+        os.makedirs(partial, exist_ok=True)
+        for name, value in outputs.items():
+            with open(os.path.join(partial, f"{name}.pkl"), "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(partial, path)
+        self.evict(keep=key)
+
+    def entries(self):
+        # (last use, size, key) of every entry
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self.entry_path(key)
+            if key.endswith(".partial") or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(path).st_mtime_ns, size, key))
+        return entries
+
+    def evict(self, keep=None):
+        # Remove the least recently used entries until the cache fits
+        entries = sorted(self.entries(), reverse=True)
+        total = 0
+        for _, size, key in entries:
+            total += size
+            if total > self.max_bytes and key != keep:
+                shutil.rmtree(self.entry_path(key), ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from functools import wraps
+import pandas as pd
+
+# Memoized chart builders.
+#
+# Streamlit reruns a page from the top on every widget change, typing a
+# comment included, and the builders in tools.py would prepare the same
+# frames and build the same Altair or Plotly charts each time. A builder
+# wrapped in memoize_chart keeps its charts in an LRU of at most
+# CHART_CACHE_ENTRIES charts, shared by the sessions of the process.
+#
+# The key is the builder's name, the other arguments as they are and a
+# cheap fingerprint of each frame argument: the slice a page passes in is
+# told apart by its columns, length, teams, players and date window, and
+# the column sums catch a rebuilt table with other figures for the same
+# slice. The cached chart is returned as is, callers must not change it in
+# place.
+
+CHART_CACHE_ENTRIES = 128
+
+# Label columns whose values identify a slice
+slice_columns = ["Team Name", "Player"]
+
+charts = OrderedDict()
+charts_lock = threading.Lock()
+
+
+def frame_fingerprint(df):
+    key = [tuple(df.columns), len(df)]
+    for column in slice_columns:
+        if column in df.columns:
+            key.append(tuple(pd.unique(df[column].to_numpy(dtype=object))))
+    if "Date" in df.columns and len(df):
+        key.append((df["Date"].min(), df["Date"].max()))
+    key.append(tuple(df.select_dtypes("number").sum().tolist()))
+    return tuple(key)
+
+
+def freeze(value):
+    # Hashable stand-in for a builder argument
+    if isinstance(value, pd.DataFrame):
+        return ("frame", frame_fingerprint(value))
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def memoize_chart(builder):
+    @wraps(builder)
+    def cached_builder(*args, **kwargs):
+        key = (builder.__name__, freeze(args), freeze(kwargs))
+        with charts_lock:
+            if key in charts:
+                charts.move_to_end(key)
+                return charts[key]
+        chart = builder(*args, **kwargs)
+        with charts_lock:
+            charts[key] = chart
+            while len(charts) > CHART_CACHE_ENTRIES:
+                charts.popitem(last=False)
+        return chart
+    return cached_builder
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+from contextlib import closing
+import pandas as pd
+
+# Comment store of the dashboard pages.
+#
+# Every comment is one row of a SQLite database in WAL mode, so a submit is a
+# single INSERT and several Streamlit sessions can write at once (a writer
+# waits for the lock instead of overwriting the others). Each page has its
+# own board; comments are read by board and player, team or date through
+# the indexes below.
+#
+# The first open creates the database from the comment CSVs the dashboard
+# used to rewrite, they are left as they are.
+
+DB_PATH = "./data/comments.db"
+
+# Board -> CSV it is seeded from
+boards = {
+    "club_overview": "./data/club_overview_comment.csv",
+    "player_daily_review": "./data/player_daily_review_comment.csv",
+    "player_weekly_review": "./data/player_weekly_review_comment.csv",
+    "team_daily_training": "./data/team_daily_training_comment.csv",
+}
+
+# Column of the comments table -> column of the pages' comment tables
+comment_columns = {"player": "Player", "team": "Team", "date": "Date", "timestamp": "Timestamp",
+                   "user": "User", "comment": "Comment"}
+
+schema = """
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY,
+    board TEXT NOT NULL,
+    player TEXT,
+    team TEXT,
+    date TEXT,
+    timestamp TEXT NOT NULL,
+    user TEXT,
+    comment TEXT
+);
+CREATE INDEX IF NOT EXISTS comments_player ON comments (board, player);
+CREATE INDEX IF NOT EXISTS comments_team ON comments (board, team, date);
+CREATE INDEX IF NOT EXISTS comments_date ON comments (board, date);
+CREATE TABLE IF NOT EXISTS seeded (board TEXT PRIMARY KEY);
+"""
+
+
+# Stores set up by this process
+initialized = set()
+
+
+def connect(path=DB_PATH):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def open_store(path=DB_PATH):
+    # Connection to the store, set up on first use in the process
+    if path not in initialized:
+        init_store(path)
+        initialized.add(path)
+    return connect(path)
+
+
+def init_store(path=DB_PATH, seeds=boards):
+    # Create the tables and load the CSV of every board not seeded yet, in
+    # one write transaction so two sessions starting together seed once
+    with closing(connect(path)) as connection:
+        connection.executescript(schema)
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            seeded = {board for board, in connection.execute("SELECT board FROM seeded")}
+            for board, csv_path in seeds.items():
+                if board in seeded:
+                    continue
+                if os.path.exists(csv_path):
+                    df = pd.read_csv(csv_path, dtype=str).rename(columns={v: k for k, v in comment_columns.items()})
+                    df = df.reindex(columns=list(comment_columns)).astype(object)
+                    connection.executemany(
+                        "INSERT INTO comments (board, player, team, date, timestamp, user, comment) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(board, *row) for row in df.where(df.notna(), None).itertuples(index=False)])
+                connection.execute("INSERT INTO seeded (board) VALUES (?)", (board,))
+
+
+def add_comment(board, timestamp, user, comment, player=None, team=None, date=None, path=DB_PATH):
+    with closing(open_store(path)) as connection, connection:
+        connection.execute("INSERT INTO comments (board, player, team, date, timestamp, user, comment) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (board, player, team, None if date is None else str(date), timestamp, user, comment))
+
+
+def read_comments(board, player=None, team=None, date=None, path=DB_PATH):
+    # Comments of a board in the order they were written, of one player,
+    # team and/or date only if given
+    conditions, params = ["board = ?"], [board]
+    for column, value in [("player", player), ("team", team), ("date", date)]:
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(str(value))
+    with closing(open_store(path)) as connection:
+        df = pd.read_sql_query(f"SELECT {', '.join(comment_columns)} FROM comments "
+                               f"WHERE {' AND '.join(conditions)} ORDER BY id", connection, params=params)
+    return df.rename(columns=comment_columns)
@@ -0,0 +1,120 @@
+import os
+import numpy as np
+import pandas as pd
+import streamlit as st
+from instrument import stage
+from store import read_table, table_path, widen_floats
+
+# Shared data access for the Streamlit pages.
+#
+# Each derived table is read from the store once per process and cached
+# under its name and the latest modification time of its files, so a
+# rebuild or an incremental update is picked up on the next rerun while a
+# widget change only costs a filter. The cached frame keeps the compact
+# dtypes of the store; pages get copies of the rows they ask for with the
+# float32 columns widened back to float64, so a page changing its frame
+# never changes the shared table.
+#
+# Tables with Team Name, (Player) and Date columns are cached sorted on them
+# under a matching MultiIndex, so the lookups below slice the rows of one
+# team, player and date range by binary search instead of masking every row.
+#
+# Reading a table and cutting a page's rows out of it are recorded as the
+# "load <table>" and "filter <table>" stages of instrument.py.
+
+# Column -> index level
+index_columns = {"Team Name": "team", "Player": "player", "Date": "date"}
+
+
+def table_version(name):
+    latest = 0.0
+    for root, _, files in os.walk(table_path(name)):
+        for file in files:
+            latest = max(latest, os.path.getmtime(os.path.join(root, file)))
+    return latest
+
+
+def page_copy(df, name):
+    # The rows handed to a page: a copy on a fresh index
+    df = df.copy()
+    df.index = pd.RangeIndex(len(df))
+    return widen_floats(df, name)
+
+
+@st.cache_resource(max_entries=6, show_spinner=False)
+def cached_table(name, version):
+    with stage(f"load {name}"):
+        df = read_table(name)
+        columns = [column for column in index_columns if column in df.columns]
+        if "Team Name" in columns and "Date" in columns:
+            df.index = pd.MultiIndex.from_arrays([df[column].array for column in columns],
+                                                 names=[index_columns[column] for column in columns])
+            df = df.sort_index()
+    return df
+
+
+def load_table(name, columns=None, filters=None, dropna=False):
+    # filters: {column: value or list of values}
+    # dropna: leave out the rows with a missing value in any column of the
+    # table, not only in the columns read
+    df = cached_table(name, table_version(name))
+    with stage(f"filter {name}"):
+        if dropna:
+            df = df[df.notna().all(axis=1).to_numpy()]
+        if filters:
+            mask = np.ones(len(df), dtype=bool)
+            for column, value in filters.items():
+                values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+                mask &= df[column].isin(values).to_numpy()
+            df = df[mask]
+        if columns is not None:
+            df = df[columns]
+        return page_copy(df, name)
+
+
+def column_values(name, column):
+    # Sorted labels of a column, e.g. the teams for a select box
+    values = cached_table(name, table_version(name))[column].dropna().unique()
+    return sorted(values.tolist())
+
+
+def lookup(name, teams, player=None, start=None, end=None):
+    # Rows of one or more teams, optionally one player, between two dates
+    # (both included)
+    df = cached_table(name, table_version(name))
+    teams = [teams] if isinstance(teams, str) else list(teams)
+    dates = slice(None if start is None else pd.Timestamp(start), None if end is None else pd.Timestamp(end))
+    players = (slice(None) if player is None else player,) if "player" in df.index.names else ()
+    with stage(f"filter {name}"):
+        parts = []
+        for team in teams:
+            try:
+                parts.append(df.loc[(team, *players, dates), :])
+            except KeyError:
+                continue
+        if not parts:
+            return page_copy(df.iloc[:0], name)
+        return page_copy(pd.concat(parts), name)
+
+
+def day_rows(name, teams, date, player=None):
+    return lookup(name, teams, player, date, date)
+
+
+def week_rows(name, teams, date, player=None):
+    # Monday to Sunday around the date, cut at the turn of the year like the
+    # Year-Week labels
+    date = pd.Timestamp(date)
+    start = max(date - pd.Timedelta(days=date.weekday()), pd.Timestamp(date.year, 1, 1))
+    end = min(date + pd.Timedelta(days=6 - date.weekday()), pd.Timestamp(date.year, 12, 31))
+    return lookup(name, teams, player, start, end)
+
+
+def window_rows(name, teams, player, end, days):
+    # The trailing window of the given number of days up to the end date of
+    # one player; no rows without a player (a team's rest day leaves the
+    # player select box empty) rather than the rows of every player
+    end = pd.Timestamp(end)
+    if player is None:
+        teams = []
+    return lookup(name, teams, player, end - pd.Timedelta(days=days), end)
@@ -0,0 +1,71 @@
+import numpy as np
+
+# Downsampling of chart data before the Altair spec is built.
+#
+# Altair embeds every row of a chart's frame in the page, so a long date
+# range means a large payload and a slow render. A chart gets at most
+# `budget` points: line series keep the points picked by Largest Triangle
+# Three Buckets (LTTB), which keeps the peaks and dips that matter for the
+# ACWR thresholds, bars are averaged over the shortest period (day, week,
+# month, quarter or year) that fits the budget.
+
+MAX_CHART_POINTS = 500
+
+bucket_periods = ["D", "W", "M", "Q", "Y"]
+
+
+def lttb_indices(x, y, budget):
+    # Positions of the points LTTB keeps out of (x, y) sorted by x: the first
+    # and last point, and per bucket the point making the largest triangle
+    # with the point kept before it and the average of the next bucket
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if budget is None or n <= budget:
+        return np.arange(n)
+    # no room for a bucket: the ends of the line
+    if budget < 3:
+        return np.array([0, n - 1], dtype=np.int64)
+    edges = np.linspace(1, n - 1, budget - 1).astype(np.int64)
+    keep = np.empty(budget, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+    for i in range(budget - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        # an infinite value (e.g. an imbalance over zero) is kept first
+        with np.errstate(invalid="ignore"):
+            area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                          - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        area = np.nan_to_num(area, nan=np.inf)
+        previous = start + int(np.argmax(area))
+        keep[i + 1] = previous
+    return keep
+
+
+def lttb(df, x, y, budget=MAX_CHART_POINTS):
+    # Rows of df (sorted by x) LTTB keeps for the line of y over x
+    df = df.sort_values(x)
+    values = df[x].to_numpy()
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype("datetime64[ns]").astype(np.int64)
+    return df.iloc[lttb_indices(values, df[y].to_numpy(), budget)]
+
+
+def bucket_period(dates, budget):
+    # Shortest period that splits the dates into at most budget buckets
+    for period in bucket_periods:
+        if dates.dt.to_period(period).nunique() <= budget:
+            return period
+    return bucket_periods[-1]
+
+
+def bucket_mean(df, columns, budget=MAX_CHART_POINTS, date="Date"):
+    # Mean of the columns per period, dated at the start of the period; the
+    # rows as they are if they fit the budget
+    if budget is None or len(df) <= budget:
+        return df
+    period = bucket_period(df[date], budget)
+    buckets = df[date].dt.to_period(period).dt.start_time.rename(date)
+    return df.groupby(buckets)[columns].mean().reset_index()
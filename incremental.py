@@ -0,0 +1,283 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from acwr import calc_ewma_acwr
+from ingest import read_sessions
+from store import read_table, write_table, table_columns
+from transforms import (ROLLING_CHRONIC_DAYS, complete_rows, metrics, intensity_metrics, combination_columns,
+                        week_player_keys, week_team_keys, player_week_max_keys, order_sessions,
+                        daily_steps, grid_weeks, weekly_steps, add_calendar, aggregate_weeks,
+                        aggregate_overview_weeks, add_average_attendance, aggregate_team_days,
+                        aggregate_team_weeks, aggregate_player_week_max, rolling_loads, get_training_intensity,
+                        get_imbalance, flag_abnormal, add_week_dates)
+
+# Incremental update of the derived tables.
+#
+# A full run of pre_processing.py leaves a snapshot of where it stopped in
+# ./data/state: the first and last day of the date range (the grid of the
+# EWMA walks), the day of the last session, the known (Player,
+# Position, Team Name) combinations, the session count of every player, the
+# EWMA state of the daily ACWR and the sessions of the last 28 days. A new
+# GPS export is then processed from that snapshot only:
+#
+#   python incremental.py ./data/new_export.csv
+#
+# New sessions are appended to the df_all dataset, the ISO weeks they fall
+# in are re-aggregated and replaced in the weekly tables. The seasons, teams
+# and thresholds are the settings of the pipeline run that saved the state.
+
+DATA_DIR = "./data"
+STATE_DIR = "./data/state"
+
+recent_columns = ['Date'] + combination_columns + ['Year', 'Week', 'Year-Week'] + metrics
+
+
+def recent_rows(df_all):
+    # The columns of df_all rows kept in the state, with whether the row has
+    # every column of df_all (see transforms.aggregate_overview_weeks)
+    return df_all[recent_columns].assign(Complete=complete_rows(df_all))
+
+
+def save_ewma_state(state, metric_names, path):
+    n_groups, n_cols = state["weighted"].shape
+    pd.DataFrame({
+        "Player": np.repeat(state["groups"], n_cols),
+        "Span": np.tile(np.repeat(["Acute", "Chronic"], len(metric_names)), n_groups),
+        "Metric": np.tile(metric_names * 2, n_groups),
+        "Weighted": state["weighted"].ravel(),
+        "Old Weight": state["old_wt"].ravel(),
+        "Observations": state["nobs"].ravel(),
+        "Last Step": np.repeat(state["last_step"], n_cols),
+    }).to_csv(path, index=False)
+
+
+def load_ewma_state(path, metric_names):
+    df = pd.read_csv(path, float_precision="round_trip")
+    groups = pd.Index(pd.unique(df["Player"]))
+    n_cols = 2 * len(metric_names)
+    if list(df["Metric"].head(n_cols)) != metric_names * 2 or "Last Step" not in df.columns:
+        raise ValueError(f"{path} was saved by an older pipeline, run pre_processing.py for a full rebuild")
+    return {
+        "groups": groups,
+        "weighted": df["Weighted"].to_numpy().reshape(len(groups), n_cols),
+        "old_wt": df["Old Weight"].to_numpy().reshape(len(groups), n_cols),
+        "nobs": df["Observations"].to_numpy().reshape(len(groups), n_cols),
+        "last_step": df["Last Step"].to_numpy()[::n_cols],
+    }
+
+
+def save_state(first_date, last_date, last_session, combinations, training_count, ewma_state, df_all,
+               state_dir=STATE_DIR, settings=None):
+    # last_date ends the date range, which can run past the last session
+    # (the end of the season by default)
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, "meta.json"), "w") as f:
+        json.dump({"first_date": str(first_date.date()), "last_date": str(last_date.date()),
+                   "last_session": str(last_session.date()), "settings": settings or {}}, f)
+    combinations[combination_columns].to_csv(os.path.join(state_dir, "combinations.csv"), index=False)
+    training_count.rename_axis("Player").rename("Sessions").to_csv(os.path.join(state_dir, "training_count.csv"))
+    save_ewma_state(ewma_state, metrics + intensity_metrics, os.path.join(state_dir, "ewma_state.csv"))
+
+    # The sessions of the last 28 days cover every ISO week the next export
+    # can touch and the rolling windows of its days
+    # (df_all: the full table, or recent rows already made by recent_rows)
+    recent = df_all[df_all['Date'] > last_session - pd.Timedelta(days=max(7, ROLLING_CHRONIC_DAYS))]
+    if "Complete" not in recent.columns:
+        recent = recent_rows(recent)
+    recent.to_csv(os.path.join(state_dir, "recent_sessions.csv"), index=False)
+
+
+def load_state(state_dir=STATE_DIR):
+    if not os.path.exists(os.path.join(state_dir, "meta.json")):
+        raise FileNotFoundError(f"No pipeline state in {state_dir}, run pre_processing.py first")
+    with open(os.path.join(state_dir, "meta.json")) as f:
+        meta = json.load(f)
+    if "last_session" not in meta:
+        raise ValueError(f"{state_dir} was saved by an older pipeline, run pre_processing.py for a full rebuild")
+    recent_sessions = pd.read_csv(os.path.join(state_dir, "recent_sessions.csv"), parse_dates=["Date"],
+                                  float_precision="round_trip")
+    if "Complete" not in recent_sessions.columns:
+        raise ValueError(f"{state_dir} was saved by an older pipeline, run pre_processing.py for a full rebuild")
+    return {
+        "first_date": pd.Timestamp(meta["first_date"]),
+        "last_date": pd.Timestamp(meta["last_date"]),
+        "last_session": pd.Timestamp(meta["last_session"]),
+        "settings": meta.get("settings", {}),
+        "combinations": pd.read_csv(os.path.join(state_dir, "combinations.csv")),
+        "training_count": pd.read_csv(os.path.join(state_dir, "training_count.csv"), index_col="Player")["Sessions"],
+        "ewma": load_ewma_state(os.path.join(state_dir, "ewma_state.csv"), metrics + intensity_metrics),
+        "recent_sessions": recent_sessions,
+    }
+
+
+def read_header(path):
+    with open(path, encoding="utf-8") as f:
+        return f.readline().rstrip("\r\n")
+
+
+def check_export(export_path, raw_path):
+    # The export's lines are appended to the raw history as they are, so the
+    # columns must be the same and in the same order
+    if read_header(export_path) != read_header(raw_path):
+        raise ValueError(f"{export_path} does not have the columns of {raw_path} in the same order")
+
+
+def append_raw_export(export_path, raw_path):
+    # Keep the export in the raw history so the next full rebuild sees it;
+    # returns the size of the history before, to take the export back out
+    with open(export_path, encoding="utf-8") as f:
+        lines = f.readlines()[1:]
+    size = os.path.getsize(raw_path)
+    with open(raw_path, "rb") as f:
+        f.seek(max(size - 1, 0))
+        ends_with_newline = size == 0 or f.read(1) == b"\n"
+    with open(raw_path, "a", encoding="utf-8") as f:
+        if not ends_with_newline:
+            f.write("\n")
+        f.writelines(line if line.endswith("\n") else line + "\n" for line in lines)
+    return size
+
+
+def replace_weeks(df, new_rows, keys, affected_weeks):
+    # Swap the rows of the affected ISO weeks and put the table back in
+    # groupby order
+    columns = df.columns
+    df = df[~(df["Year"] * 100 + df["Week"]).isin(affected_weeks)]
+    df = pd.concat([df, new_rows], ignore_index=True)
+    return df.sort_values(keys, kind="stable", ignore_index=True)[columns]
+
+
+def update(export_path, data_dir=DATA_DIR, state_dir=STATE_DIR):
+    # pipeline.py saves the state through this module, so it is imported here
+    from pipeline import Pipeline
+
+    state = load_state(state_dir)
+    first_date, last_date, last_session = state["first_date"], state["last_date"], state["last_session"]
+    pipeline = Pipeline(os.path.join(data_dir, "anonymous.csv"), data_dir, state_dir, **state["settings"])
+
+    # The export goes into the raw history last, once the tables and the
+    # state are written, so an update that fails can be run again
+    raw_path = os.path.join(data_dir, "anonymous.csv")
+    check_export(export_path, raw_path)
+    sessions = read_sessions(export_path, min_duration=pipeline.min_duration, teams=pipeline.teams)
+    if (sessions['Date'] <= last_session).any():
+        raise ValueError(f"{export_path} has sessions on or before {last_session.date()}, "
+                         "run pre_processing.py for a full rebuild")
+    if sessions.empty:
+        append_raw_export(export_path, raw_path)
+        return
+
+    previous_count = state["training_count"]
+    training_count = previous_count.add(sessions["Player"].value_counts(), fill_value=0).astype(int)
+    eligible = training_count[training_count>=pipeline.min_training_count].index
+    sessions = sessions[sessions['Player'].isin(eligible)]
+    if sessions.empty:
+        save_state(first_date, last_date, last_session, state["combinations"], training_count, state["ewma"],
+                   state["recent_sessions"], state_dir, pipeline.settings())
+        append_raw_export(export_path, raw_path)
+        return
+
+    # Players reaching the minimum count bring their earlier sessions into
+    # every table, and a player moving to a new team or position adds a step
+    # per day to their whole EWMA walk. Both need the full history.
+    known_players = previous_count[previous_count>=pipeline.min_training_count].index
+    promoted = eligible.difference(known_players)
+    new_combinations = sessions[combination_columns].drop_duplicates().merge(
+        state["combinations"], how="left", indicator=True)
+    new_combinations = new_combinations[new_combinations["_merge"] == "left_only"][combination_columns]
+    if ((previous_count.reindex(promoted).fillna(0) > 0).any() or
+            new_combinations["Player"].isin(known_players).any()):
+        # The rebuild reads the export from the raw history, which is put
+        # back as it was if the rebuild fails
+        print("Player history changed, running a full rebuild")
+        size = append_raw_export(export_path, raw_path)
+        try:
+            pipeline.run()
+        except BaseException:
+            os.truncate(raw_path, size)
+            raise
+        return
+
+    # %% daily table: new sessions only, ACWR carried on from the saved state
+    combinations = pd.concat([state["combinations"], new_combinations], ignore_index=True)
+    # The default date range only grows: a full rebuild runs it to the later
+    # of the end of the seasons and the last session. A given last day stays
+    # the end and the sessions after it are left out, as in a full rebuild
+    new_last_session = sessions['Date'].max()
+    if pipeline.last_day:
+        new_last_date = last_date
+        sessions = sessions[sessions['Date'] <= last_date]
+        if sessions.empty:
+            save_state(first_date, last_date, new_last_session, combinations, training_count, state["ewma"],
+                       state["recent_sessions"], state_dir, pipeline.settings())
+            append_raw_export(export_path, raw_path)
+            return
+    else:
+        new_last_date = max(last_date, new_last_session)
+
+    df_new = order_sessions(combinations, sessions)
+    df_new = add_calendar(df_new, pipeline.seasons)
+
+    df_new = get_training_intensity(df_new)
+    df_new = get_imbalance(df_new, pipeline.imbalance_threshold)
+    df_new = calc_ewma_acwr(df_new, metrics + intensity_metrics, state=state["ewma"],
+                            steps=daily_steps(df_new, combinations, first_date))
+    df_new = flag_abnormal(df_new, pipeline.high_acwr, pipeline.low_acwr)
+
+    df_new = df_new[table_columns("df_all", data_dir)]
+    write_table(df_new, "df_all", data_dir, append=True)
+    recent = pd.concat([state["recent_sessions"], recent_rows(df_new)], ignore_index=True)
+
+    # The new days only add rows to the daily team summary, the weekly one
+    # is small and rebuilt from it
+    write_table(aggregate_team_days(df_new), "df_team_day", data_dir, append=True)
+    write_table(aggregate_team_weeks(read_table("df_team_day", data_dir=data_dir)), "df_team_week", data_dir)
+
+    # A week's player maxima are the maxima of its stored and new rows
+    df_week_player_max = pd.concat([read_table("df_week_player_max", data_dir=data_dir),
+                                    aggregate_player_week_max(df_new)], ignore_index=True)
+    maxima = {column: "max" for column in df_week_player_max.columns if column.startswith("Max ")}
+    df_week_player_max = df_week_player_max.groupby(player_week_max_keys, observed=True).agg(
+        {"Year-Week": "first", **maxima}).reset_index()
+    write_table(df_week_player_max, "df_week_player_max", data_dir)
+
+    # The rolling windows of the new days look back over the recent sessions
+    df_rolling = rolling_loads(recent, pipeline.rolling_min_periods)
+    write_table(df_rolling[len(state["recent_sessions"]):], "df_rolling", data_dir, append=True)
+
+    # %% weekly tables: re-aggregate the ISO weeks the new days fall in
+    affected_weeks = (df_new["Year"] * 100 + df_new["Week"]).unique()
+    week_rows = recent[(recent["Year"] * 100 + recent["Week"]).isin(affected_weeks)]
+    new_week_player, new_week_team = aggregate_weeks(week_rows)
+    new_week_player = get_imbalance(get_training_intensity(new_week_player), pipeline.imbalance_threshold)
+    new_week_team = get_training_intensity(new_week_team)
+
+    # The weekly ACWR walks each player's weeks combination by combination,
+    # so it is recomputed over the (small) weekly table
+    df_week_player = read_table("df_week_player", data_dir=data_dir)
+    df_week_player = replace_weeks(df_week_player, add_week_dates(new_week_player, pipeline.seasons), week_player_keys, affected_weeks)
+    df_week_player = calc_ewma_acwr(df_week_player, metrics + intensity_metrics, acute_days=1, chronic_days=3,
+                                    steps=weekly_steps(df_week_player, combinations, grid_weeks(first_date, new_last_date)))
+    df_week_player = flag_abnormal(df_week_player, pipeline.high_acwr, pipeline.low_acwr)
+    write_table(df_week_player, "df_week_player", data_dir)
+
+    df_week_team = read_table("df_week_team", data_dir=data_dir)
+    df_week_team = replace_weeks(df_week_team, add_week_dates(new_week_team, pipeline.seasons), week_team_keys, affected_weeks)
+    write_table(df_week_team, "df_week_team", data_dir)
+
+    # The average attendance runs over every week of a team
+    df_week_overview = read_table("df_week_overview", data_dir=data_dir)
+    new_week_overview = aggregate_overview_weeks(get_training_intensity(week_rows.copy()), week_rows["Complete"].to_numpy())
+    df_week_overview = replace_weeks(df_week_overview, new_week_overview, ["Team Name", "Year", "Week"], affected_weeks)
+    df_week_overview = add_average_attendance(df_week_overview)
+    write_table(df_week_overview, "df_week_overview", data_dir)
+
+    save_state(first_date, new_last_date, new_last_session, combinations, training_count, state["ewma"],
+               recent, state_dir, pipeline.settings())
+    append_raw_export(export_path, raw_path)
+
+
+if __name__ == "__main__":
+    update(sys.argv[1])
@@ -0,0 +1,45 @@
+import pandas as pd
+from transforms import MIN_DURATION, raw_columns, raw_dtypes, prepare_sessions
+
+# Streaming ingest of the raw GPS export.
+#
+# The raw CSV is never loaded whole: it is read in chunks of CHUNK_SIZE rows
+# with only the export columns and compact dtypes (labels as categoricals,
+# the date as text until it is parsed). A first pass reads two columns to
+# count the sessions of every player, the second pass keeps only the
+# sessions that pass the duration and player filters, chunk by chunk.
+
+CHUNK_SIZE = 100_000
+
+
+def read_chunks(path, columns=raw_columns, chunksize=CHUNK_SIZE):
+    return pd.read_csv(path, usecols=columns, dtype={column: raw_dtypes[column] for column in columns},
+                       chunksize=chunksize)
+
+
+def count_sessions(path, chunksize=CHUNK_SIZE, min_duration=MIN_DURATION):
+    # Sessions of at least min_duration minutes per player
+    counts = pd.Series(dtype="int64")
+    for chunk in read_chunks(path, ['player', 'duration'], chunksize):
+        chunk_counts = chunk.loc[chunk['duration'] >= min_duration, 'player'].value_counts()
+        chunk_counts.index = chunk_counts.index.astype(str)
+        counts = counts.add(chunk_counts[chunk_counts > 0], fill_value=0)
+    return counts.astype("int64").sort_values(ascending=False, kind="stable").rename_axis("Player").rename("count")
+
+
+def read_sessions(path, players=None, chunksize=CHUNK_SIZE, min_duration=MIN_DURATION, teams=None):
+    # Sessions of at least min_duration minutes, of the given players and
+    # teams only if any, renamed and converted by prepare_sessions
+    chunks = []
+    for chunk in read_chunks(path, chunksize=chunksize):
+        chunk = chunk[raw_columns]
+        if players is not None:
+            chunk = chunk[chunk['player'].isin(players)]
+        if teams is not None:
+            chunk = chunk[chunk['team_name'].isin(teams)]
+        chunks.append(prepare_sessions(chunk, min_duration))
+    # The pipeline steps join and group on the labels as plain strings
+    df = pd.concat(chunks)
+    for column in ['Player', 'Position', 'Team Name']:
+        df[column] = df[column].astype(object)
+    return df
@@ -0,0 +1,132 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import pandas as pd
+
+# Per-rerun timing of the Streamlit pages.
+#
+# A page calls start_rerun(page) at the top and finish_rerun() at the end.
+# In between, every block run inside `with stage(name):` and every call of
+# a function wrapped in @timed(kind) records its wall time and the change
+# of the process' resident memory under names like "load df_all",
+# "filter df_all" or "chart draw_acwr". Nested stages are each recorded,
+# so their times add up to more than the rerun. Outside a rerun, e.g. in
+# the pipeline, stages record nothing unless run inside `with record():`,
+# which bench.py uses to time the pipeline's stages and their steps.
+#
+# finish_rerun appends the rerun as one JSON line to LOG_PATH, rolled over
+# to LOG_PATH + ".1" past LOG_MAX_BYTES, and with ?debug=1 in the page's
+# URL lists the stages in the sidebar. A rerun cut short by st.rerun() or
+# an error is not logged.
+
+LOG_PATH = "./data/logs/reruns.jsonl"
+LOG_MAX_BYTES = 5 * 2 ** 20
+
+# The rerun of the script thread, if any
+current = threading.local()
+log_lock = threading.Lock()
+
+
+def rss_mb():
+    # Resident memory of the process, the high-water mark where /proc is
+    # missing (kB on Linux, bytes on macOS)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@contextmanager
+def stage(name):
+    rerun = getattr(current, "rerun", None)
+    if rerun is None:
+        yield
+        return
+    start, memory = time.perf_counter(), rss_mb()
+    try:
+        yield
+    finally:
+        rerun["stages"].append({"stage": name,
+                                "start": round(start - rerun["started"], 4),
+                                "seconds": round(time.perf_counter() - start, 4),
+                                "rss_delta_mb": round(rss_mb() - memory, 1)})
+
+
+@contextmanager
+def record():
+    # Records the stages of the block outside a rerun; yields their list
+    previous = getattr(current, "rerun", None)
+    current.rerun = {"started": time.perf_counter(), "stages": []}
+    try:
+        yield current.rerun["stages"]
+    finally:
+        current.rerun = previous
+
+
+def timed(kind):
+    # Decorator recording each call as the stage "<kind> <function name>"
+    def decorate(function):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            with stage(f"{kind} {function.__name__}"):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorate
+
+
+def start_rerun(page):
+    import streamlit as st
+    st.session_state.setdefault("instrument_session", uuid.uuid4().hex[:8])
+    st.session_state["instrument_reruns"] = st.session_state.get("instrument_reruns", 0) + 1
+    current.rerun = {"time": datetime.now().isoformat(timespec="seconds"), "page": page,
+                     "session": st.session_state["instrument_session"],
+                     "rerun": st.session_state["instrument_reruns"],
+                     "rss_mb": round(rss_mb(), 1), "started": time.perf_counter(), "stages": []}
+
+
+def finish_rerun(log_path=LOG_PATH):
+    import streamlit as st
+    rerun = getattr(current, "rerun", None)
+    if rerun is None:
+        return
+    current.rerun = None
+    rerun["seconds"] = round(time.perf_counter() - rerun.pop("started"), 4)
+    rerun["rss_delta_mb"] = round(rss_mb() - rerun["rss_mb"], 1)
+    write_log(rerun, log_path)
+    if st.query_params.get("debug"):
+        with st.sidebar.expander("Timings", expanded=True):
+            st.markdown(f"Rerun {rerun['rerun']}: {rerun['seconds']:.3f}s, "
+                        f"{rerun['rss_delta_mb']:+.1f} MB")
+            st.dataframe(pd.DataFrame(rerun["stages"], columns=["stage", "start", "seconds", "rss_delta_mb"]),
+                         hide_index=True, use_container_width=True)
+
+
+def write_log(record, log_path=LOG_PATH, max_bytes=LOG_MAX_BYTES):
+    with log_lock:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        if os.path.exists(log_path) and os.path.getsize(log_path) > max_bytes:
+            os.replace(log_path, log_path + ".1")
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def read_log(log_path=LOG_PATH):
+    # One row per recorded stage with its rerun's page, session and number,
+    # for finding the hot spots offline
+    reruns = []
+    for path in (log_path + ".1", log_path):
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                reruns.extend(json.loads(line) for line in f)
+    if not reruns:
+        return pd.DataFrame(columns=["stage", "start", "seconds", "rss_delta_mb", "time", "page", "session", "rerun"])
+    return pd.json_normalize(reruns, "stages", ["time", "page", "session", "rerun"])
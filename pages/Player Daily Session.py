@@ -1,11 +1,10 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-import datetime
 from tools import info_box, draw_acwr, metrics_classes, get_not_passed_metrics, submit_comment, draw_ima_cod
+from data_access import column_values, lookup, day_rows, week_rows, window_rows
+from instrument import start_rerun, finish_rerun, stage
 
-df_all = pd.read_csv("./data/df_all.csv", parse_dates=["Date"], date_format='%Y-%m-%d')
-comment_table = pd.read_csv("./data/player_daily_review_comment.csv")
 
 
 # ========================
@@ -13,27 +12,28 @@ comment_table = pd.read_csv("./data/player_daily_review_comment.csv")
 # ========================
 
 st.set_page_config(layout="wide")
+start_rerun("Player Daily Session")
 
 
 
 # ========================
 # Filter
 # ========================
-teams = df_all['Team Name'].unique()
+teams = column_values("df_all", "Team Name")
 default_team = 'Team1' if 'Team1' in teams else teams[0]
 selected_teams = st.sidebar.selectbox('Team', teams)
 
+# Every view on this page is about the selected team
+team_sessions = lookup("df_all", selected_teams).dropna()
+
 # Date filter
-date_min = df_all.dropna()['Date'].min().date()
-date_max = df_all.dropna()['Date'].max().date()
+date_min = team_sessions['Date'].min().date()
+date_max = team_sessions['Date'].max().date()
 selected_date = st.sidebar.date_input('Date', value=date_max, min_value=date_min, max_value=date_max, format="YYYY/MM/DD")
 selected_weekday = pd.to_datetime(selected_date).strftime('%A')
 
 # filtered df
-filtered_df = df_all[
-    (df_all['Team Name']==selected_teams) &
-    (df_all['Date'] == pd.to_datetime(selected_date))
-].dropna()
+filtered_df = day_rows("df_all", selected_teams, selected_date).dropna()
 
 # Player filter
 players = filtered_df['Player'].unique()
@@ -43,19 +43,16 @@ selected_player = st.sidebar.selectbox('Player', players, index=0 if default_pla
 attendance = len(filtered_df)
 if attendance:
     year_week = filtered_df["Year-Week"].values[0]
+    filtered_df_week = week_rows("df_all", selected_teams, selected_date, selected_player).dropna()
 else:
     year_week = "No session"
-
-filtered_df_week = df_all[
-    (df_all['Team Name'] == selected_teams) &
-    (df_all["Year-Week"] == year_week) &
-    (df_all["Player"] == selected_player)
-].dropna()
+    filtered_df_week = filtered_df
 
 # team daily status
 avg_cols = [ "Total Distance(m)", "Total Player Load","Duration", "High Intensity Distance(m)", "Sprint Distance(m)"]
 selected_team_metric = st.sidebar.selectbox('Weekly Team Overview', avg_cols)
-mean_by_weekday = filtered_df_week.groupby('Weekday')[selected_team_metric].mean().reset_index()
+with stage("aggregate weekday means"):
+    mean_by_weekday = filtered_df_week.groupby('Weekday', observed=True)[selected_team_metric].mean().reset_index()
 # Create the bar chart with Altair
 highlight = alt.condition(
     alt.datum.Weekday == selected_weekday,
@@ -77,22 +74,9 @@ st.sidebar.altair_chart(bar_chart, use_container_width=True)
 
 
 # Filter the data based on selections
-filtered_df_player = df_all[
-    (df_all['Team Name']== selected_teams) &
-    (df_all['Player'] == selected_player) &
-    (df_all['Date'] == pd.to_datetime(selected_date))
-]
-
-filtered_df_player_all = df_all[
-    (df_all['Team Name']== selected_teams) &
-    (df_all['Player'] == selected_player) 
-]
-
-last_30_days_start = filtered_df_player['Date'].max() - datetime.timedelta(days=30)
-last_30_days_df = df_all[(df_all['Date'] >= last_30_days_start) &
-                         (df_all['Date'] <= pd.to_datetime(selected_date)) &
-                        (df_all['Team Name']== selected_teams) &
-                        (df_all['Player'] == selected_player)].dropna()
+filtered_df_player = day_rows("df_all", selected_teams, selected_date, selected_player)
+
+last_30_days_df = window_rows("df_all", selected_teams, selected_player, selected_date, 30).dropna()
 
 # team df: filtered_df
 
@@ -195,7 +179,7 @@ with st.container():
                 {selected_player} doesn't have training session.""")
         
 for key, value in not_pass_metrics.items():
-    with st.container():
+    with st.container(), stage(f"{key} charts"):
         summary, visual = st.columns(2)
         with summary:
             st.markdown(f"### {key}")
@@ -219,3 +203,5 @@ for key, value in not_pass_metrics.items():
                 selected_metric_volumn = st.selectbox(f"Select {key} Metric", metrics_classes[key])
                 st.altair_chart(draw_acwr(last_30_days_df, selected_metric_volumn),use_container_width=True, theme="streamlit")
 
+
+finish_rerun()
@@ -2,42 +2,50 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 from tools import info_box, metrics_classes, team_individual_graph, submit_team_comment
+from data_access import column_values, lookup, day_rows, week_rows
+from comments import read_comments
+from instrument import start_rerun, finish_rerun, stage
 
-df_all = pd.read_csv("./data/df_all.csv", parse_dates=["Date"], date_format='%Y-%m-%d')
 st.set_page_config(layout="wide")
-comment_table = pd.read_csv("./data/team_daily_training_comment.csv")
+start_rerun("Team Daily Session")
 
-teams = df_all['Team Name'].unique()
+teams = column_values("df_all", "Team Name")
 default_team = 'Team1' if 'Team1' in teams else teams[0]
 selected_teams = st.sidebar.selectbox('Team', teams)
 
+# Every view on this page is about the selected team
+team_sessions = lookup("df_all", selected_teams).dropna()
+
 # Date filter
-date_min = df_all.dropna()['Date'].min().date()
-date_max = df_all.dropna()['Date'].max().date()
+date_min = team_sessions['Date'].min().date()
+date_max = team_sessions['Date'].max().date()
 selected_date = st.sidebar.date_input('Date', value=date_max, min_value=date_min, max_value=date_max, format="YYYY/MM/DD")
 selected_weekday = pd.to_datetime(selected_date).strftime('%A')
 
 # filtered df
-filtered_df = df_all[
-    (df_all['Team Name']==selected_teams) &
-    (df_all['Date'] == pd.to_datetime(selected_date))
-].dropna()
+filtered_df = day_rows("df_all", selected_teams, selected_date).dropna()
 
+# The team's figures of the day and of its week come precomputed by the
+# pipeline (df_team_day, df_team_week), like the players' weekly maxima of
+# the charts below (df_week_player_max); a row of NaN without a session
+day_summary = day_rows("df_team_day", selected_teams, selected_date).reindex([0]).iloc[0]
 attendance = len(filtered_df)
 if attendance:
-    year_week = filtered_df["Year-Week"].values[0]
+    year_week = day_summary["Year-Week"]
+    week_summary = day_rows("df_team_week", selected_teams, day_summary["Week Start"]).reindex([0]).iloc[0]
+    week_days = week_rows("df_team_day", selected_teams, selected_date)
+    week_max = day_rows("df_week_player_max", selected_teams, day_summary["Week Start"])
 else:
     year_week = "No session"
-
-filtered_df_week = df_all[
-    (df_all['Team Name'] == selected_teams) &
-    (df_all["Year-Week"] == year_week)
-].dropna()
+    week_summary = day_summary
+    week_days = day_rows("df_team_day", selected_teams, selected_date)
+    week_max = day_rows("df_week_player_max", selected_teams, selected_date)
 
 # team daily status
 avg_cols = [ "Total Distance(m)", "Total Player Load","Duration", "High Intensity Distance(m)", "Sprint Distance(m)"]
 selected_team_metric = st.sidebar.selectbox('Weekly Team Overview', avg_cols)
-mean_by_weekday = filtered_df_week.groupby('Weekday')[selected_team_metric].mean().reset_index()
+# Within a week every weekday is one day, its mean is the day's mean
+mean_by_weekday = week_days[['Weekday', selected_team_metric]]
 # Create the bar chart with Altair
 highlight = alt.condition(
     alt.datum.Weekday == selected_weekday,
@@ -60,6 +68,16 @@ st.sidebar.altair_chart(bar_chart, use_container_width=True)
 
 st.markdown(f"# {selected_date}({year_week}) {selected_teams} Training Overview")
 
+
+def day_figure(metric, decimals=0):
+    # The day's team mean and its share of the week's highest daily mean
+    if not attendance:
+        return year_week, 100
+    today = round(day_summary[metric], 1)
+    percentage = round(today / week_summary[f"Max Daily Avg {metric}"] * 100, decimals)
+    return today, percentage
+
+
 # traffic light
 attendance_num, avg_duration, avg_distance, avg_load, avg_intensity, avg_sprint = st.columns(6)
 with attendance_num:
@@ -71,9 +89,7 @@ with attendance_num:
             unsafe_allow_html=True)
 with avg_duration:
     if attendance:
-        today = filtered_df["Duration"].mean().round(1)
-        max_of_avg_of_weekday= filtered_df_week.groupby("Weekday")["Duration"].mean().max()
-        percentage = ((today/max_of_avg_of_weekday)*100).round(0)
+        today, percentage = day_figure("Duration")
     else:
         today = year_week
         percentage = 100
@@ -88,9 +104,7 @@ with avg_duration:
 
 with avg_distance:
     if attendance:
-        today = filtered_df["Total Distance(m)"].mean().round(1)
-        max_of_avg_of_weekday= filtered_df_week.groupby("Weekday")["Total Distance(m)"].mean().max()
-        percentage = ((today/max_of_avg_of_weekday)*100).round(0)
+        today, percentage = day_figure("Total Distance(m)")
     else:
         today = year_week
         percentage = 100
@@ -103,9 +117,7 @@ with avg_distance:
                 unsafe_allow_html=True)
 with avg_load:
     if attendance:
-        today = filtered_df["Total Player Load"].mean().round(1)
-        max_of_avg_of_weekday= filtered_df_week.groupby("Weekday")["Total Player Load"].mean().max()
-        percentage = ((today/max_of_avg_of_weekday)*100).round(0)
+        today, percentage = day_figure("Total Player Load")
     else:
         today = year_week
         percentage = 100
@@ -117,9 +129,7 @@ with avg_load:
                         ),
                 unsafe_allow_html=True)
 with avg_intensity:
-    today = filtered_df["High Intensity Distance(m)"].mean().round(1)
-    max_of_avg_of_weekday= filtered_df_week.groupby("Weekday")["High Intensity Distance(m)"].mean().max()
-    percentage = ((today/max_of_avg_of_weekday)*100).round(1)
+    today, percentage = day_figure("High Intensity Distance(m)", 1)
     st.markdown(info_box(sline="Avg High Intensity(m)",
                         iconname = "fa fa-clock",
                         color_box =(0, 231, 255),
@@ -128,9 +138,7 @@ with avg_intensity:
                         ),
                 unsafe_allow_html=True)
 with avg_sprint:
-    today = filtered_df["Sprint Distance(m)"].mean().round(1)
-    max_of_avg_of_weekday= filtered_df_week.groupby("Weekday")["Sprint Distance(m)"].mean().max()
-    percentage = ((today/max_of_avg_of_weekday)*100).round(0)
+    today, percentage = day_figure("Sprint Distance(m)")
     st.markdown(info_box(sline="Avg Sprint",
                          iconname = "fas fa-exclamation-circle",
                          color_box=(0, 231, 255),
@@ -141,31 +149,31 @@ with avg_sprint:
                 
 st.markdown("---")
 # Create a Streamlit container
-with st.container():
+with st.container(), stage("charts"):
     volumn, intensity = st.columns(2)
     agility, ima = st.columns(2)
     with volumn:
         st.markdown(f"### Volume")
         selected_volumn = st.selectbox(f"Select Volume Metric", metrics_classes["Volume"], key="Volume")
-        st.altair_chart(team_individual_graph(filtered_df, filtered_df_week, selected_volumn), use_container_width=True, theme="streamlit")
+        st.altair_chart(team_individual_graph(filtered_df, week_max, selected_volumn), use_container_width=True, theme="streamlit")
     with intensity:
         st.markdown(f"### Intesity")
         selected_intensity = st.selectbox(f"Select intensity Metric", metrics_classes["Intensity"], key="intensity")
-        st.altair_chart(team_individual_graph(filtered_df, filtered_df_week, selected_intensity), use_container_width=True, theme="streamlit")
+        st.altair_chart(team_individual_graph(filtered_df, week_max, selected_intensity), use_container_width=True, theme="streamlit")
     with agility:
         st.markdown(f"### Agility")
         selected_agility = st.selectbox(f"Select Agility Metric", metrics_classes["Agility"] + ["Maximum Velocity(m/s)"], key="Agility")
-        st.altair_chart(team_individual_graph(filtered_df, filtered_df_week, selected_agility), use_container_width=True, theme="streamlit")
+        st.altair_chart(team_individual_graph(filtered_df, week_max, selected_agility), use_container_width=True, theme="streamlit")
     with ima:
         st.markdown(f"### IMA")
         selected_ima = st.selectbox(f"Select IMA Metric", metrics_classes["IMA"], key="IMA")
-        st.altair_chart(team_individual_graph(filtered_df, filtered_df_week, selected_ima), use_container_width=True, theme="streamlit")
+        st.altair_chart(team_individual_graph(filtered_df, week_max, selected_ima), use_container_width=True, theme="streamlit")
 
 
 # Comment area
-with st.container():
+with st.container(), stage("comments"):
     st.markdown("**Comment:**")
-    team_comment = comment_table[(comment_table["Team"] == selected_teams)]
+    team_comment = read_comments("team_daily_training", team=selected_teams)
 
     comment_list = (team_comment["User"] + ": " + team_comment["Comment"]).values
     if len(comment_list)==0:
@@ -186,9 +194,10 @@ with st.container():
     user = st.text_input('Your Name', '')
     comment = st.text_area('Comment:', '')
     if st.button('Submit'):
-        submit_team_comment(selected_teams, selected_date, 
-                       comment, user, comment_table, "./data/team_daily_training_comment.csv")
+        submit_team_comment(selected_teams, selected_date, comment, user)
         # reset comments
         comment = ""
         user = ""
-        st.rerun()
\ No newline at end of file
+        st.rerun()
+
+finish_rerun()
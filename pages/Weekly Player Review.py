@@ -1,11 +1,14 @@
 import streamlit as st
-import pandas as pd
 import altair as alt
 from tools import info_box, draw_acwr, metrics_classes, get_not_passed_metrics, submit_comment, draw_ima_cod
+from data_access import load_table, lookup
+from comments import read_comments
+from instrument import start_rerun, finish_rerun, stage
 
-df_all = pd.read_csv("./data/df_all.csv", parse_dates=["Date"], date_format='%Y-%m-%d')
-df_week_player = pd.read_csv("./data/df_week_player.csv", parse_dates=["Date"], date_format='%Y-%m-%d')
-comment_table = pd.read_csv("./data/player_weekly_review_comment.csv")
+start_rerun("Weekly Player Review")
+
+# The daily table only feeds the team and date filters here
+df_all = load_table("df_all", columns=["Date", "Team Name"])
 
 
 # ========================
@@ -25,8 +28,8 @@ teams = df_all['Team Name'].unique()
 default_team = 'Team1' if 'Team1' in teams else teams[0]
 selected_teams = st.sidebar.multiselect('Team', teams, default_team)
 
-# Filter the DataFrame by selected teams to get the list of players
-filtered_team_df = df_all[df_all['Team Name'].isin(selected_teams)]
+# Weekly rows of the selected teams, every player has one per week
+filtered_team_df = lookup("df_week_player", selected_teams)
 
 # Player filter (single drop down)
 players = filtered_team_df['Player'].unique()
@@ -39,13 +42,8 @@ date_max = df_all['Date'].max().date()
 selected_dates = st.sidebar.slider('Date', min_value=date_min, max_value=date_max, value=(date_min, date_max))
 
 # Filter for the traffic light
-filtered_team_traffic_df = df_all[(df_all['Team Name'].isin(selected_teams)) &     
-                                  (df_all['Date'] >= pd.to_datetime(selected_dates[0])) &
-                                  (df_all['Date'] <= pd.to_datetime(selected_dates[1]))].dropna()
-
-filtered_team_traffic_df_week = df_week_player[(df_week_player['Team Name'].isin(selected_teams)) &     
-                                  (df_week_player['Date'] >= pd.to_datetime(selected_dates[0])) &
-                                  (df_week_player['Date'] <= pd.to_datetime(selected_dates[1]))].dropna()
+filtered_team_traffic_df_week = lookup("df_week_player", selected_teams,
+                                       start=selected_dates[0], end=selected_dates[1]).dropna()
 
 
 # Risk Score filter
@@ -54,25 +52,10 @@ selected_risk = st.sidebar.slider('Risk Score', min_value=0, max_value=15, value
 
 
 # Filter the data based on selections
-filtered_df_all_player = df_all[
-    (df_all['Team Name'].isin(selected_teams)) &
-    (df_all['Player'] == selected_player) &
-    (df_all['Date'] >= pd.to_datetime(selected_dates[0])) &
-    (df_all['Date'] <= pd.to_datetime(selected_dates[1]))
-].dropna()
-
-filtered_df_week_player = df_week_player[
-    (df_week_player['Team Name'].isin(selected_teams)) &
-    (df_week_player['Player'] == selected_player) &
-    (df_week_player['Date'] >= pd.to_datetime(selected_dates[0])) &
-    (df_week_player['Date'] <= pd.to_datetime(selected_dates[1]))
-].dropna()
+filtered_df_week_player = lookup("df_week_player", selected_teams, selected_player,
+                                 selected_dates[0], selected_dates[1]).dropna()
 
-filtered_df_week_team = df_week_player[
-    (df_week_player['Team Name'].isin(selected_teams)) &
-    (df_week_player['Date'] >= pd.to_datetime(selected_dates[0])) &
-    (df_week_player['Date'] <= pd.to_datetime(selected_dates[1]))
-].dropna()
+filtered_df_week_team = filtered_team_traffic_df_week
 
 
 
@@ -127,7 +110,7 @@ with st.container():
         pass
 
 for key, value in not_pass_metrics.items():
-    with st.container():
+    with st.container(), stage(f"{key} charts"):
         summary, visual = st.columns(2)
         with summary:
             st.markdown(f"### {key}")
@@ -153,9 +136,9 @@ for key, value in not_pass_metrics.items():
 
 
 # Comment area
-with st.container():
+with st.container(), stage("comments"):
     st.markdown("**Comment:**")
-    player_comment = comment_table[(comment_table["Player"] == selected_player)]
+    player_comment = read_comments("player_weekly_review", player=selected_player)
     comment_list = (player_comment["User"] + ": " + player_comment["Comment"]).values
     if len(comment_list)==0:
         st.markdown("Ask performance team for further advice.")
@@ -175,8 +158,10 @@ with st.container():
     user = st.text_input('Your Name', '')
     comment = st.text_area('Comment:', '')
     if st.button('Submit'):
-        submit_comment(selected_player, comment, user, comment_table)
+        submit_comment(selected_player, comment, user)
         # reset comments
         comment = ""
         user = ""
         st.rerun()
+
+finish_rerun()
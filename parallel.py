@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Sharded execution of the per-player pipeline steps.
+#
+# Every player's rows go to one shard, shards are about the same size and
+# keep the row order of the frame, so a step that works per player gives the
+# same result on a shard as on the whole club. Shards run in a process pool
+# and come back in shard order, so the output does not depend on which
+# worker finishes first.
+#
+# The worker count is read from PHYLIX_WORKERS (default 1: run in process),
+# e.g. PHYLIX_WORKERS=8 python pre_processing.py
+
+WORKERS = int(os.environ.get("PHYLIX_WORKERS", 1))
+
+
+def shard_frames(df, key, n_shards):
+    # Greedy split: the largest keys first, each to the least loaded shard
+    sizes = df[key].value_counts(sort=False)
+    sizes = sizes.iloc[np.lexsort((sizes.index.astype(str), -sizes.to_numpy()))]
+    n_shards = max(1, min(n_shards, len(sizes)))
+    load = np.zeros(n_shards, dtype=np.int64)
+    shard_of = {}
+    for value, size in sizes.items():
+        shard = int(np.argmin(load))
+        shard_of[value] = shard
+        load[shard] += size
+    shards = df[key].map(shard_of).to_numpy()
+    return [df[shards == i] for i in range(n_shards)]
+
+
+def map_shards(func, frames, args=(), workers=WORKERS):
+    # func(frame, *args) for every shard, results in shard order. Workers are
+    # forked so the running script is not imported again; without fork the
+    # shards run one after the other.
+    if workers <= 1 or len(frames) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [func(frame, *args) for frame in frames]
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=min(workers, len(frames)), mp_context=context) as pool:
+        futures = [pool.submit(func, frame, *args) for frame in frames]
+        return [future.result() for future in futures]
+
+
+def concat_shards(frames, index):
+    # Put the shard results back in the row order of the unsharded frame
+    return pd.concat(frames).loc[index]
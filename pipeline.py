@@ -0,0 +1,294 @@
+import argparse
+from collections import namedtuple
+import pandas as pd
+from acwr import concat_ewma_states
+from cache import CACHE_DIR, CACHE_MAX_BYTES, StageCache, fingerprint, file_fingerprint, code_fingerprint
+from incremental import DATA_DIR, STATE_DIR, save_state
+from ingest import count_sessions, read_sessions
+from parallel import WORKERS, shard_frames, map_shards, concat_shards
+from store import write_table
+from transforms import (MIN_DURATION, MIN_TRAINING_COUNT, IMBA_THRES, HIGH_ACWR, LOW_ACWR, ROLLING_MIN_PERIODS, seasons,
+                        season_bounds, combination_columns, order_sessions, grid_weeks, add_calendar,
+                        aggregate_weeks, aggregate_overview_weeks, add_average_attendance,
+                        aggregate_team_days, aggregate_team_weeks, aggregate_player_week_max, rolling_loads,
+                        get_training_intensity, enrich_daily, enrich_weekly, add_week_dates)
+
+# The pre-processing pipeline as named stages.
+#
+# Each stage reads the results named in its inputs and returns the ones named
+# in its outputs, so a run can start from results passed in, stop early or
+# leave stages out:
+#
+#   from pipeline import Pipeline
+#   results = Pipeline(teams=["Team1"]).run(skip=["export"])
+#   results = Pipeline().run(only=["ingest", "order", "calendar"])
+#
+# or from the command line (python pipeline.py --help):
+#
+#   python pipeline.py --teams Team1 Team2 --skip export
+#
+# The settings (seasons, date range, teams and thresholds) are saved with the
+# pipeline state, so incremental.py carries on with the same ones.
+#
+# Stage results are cached in ./data/cache (see cache.py), keyed by the
+# stage's inputs, the settings it reads and the source of the modules it
+# runs, so after a change only the stages it reaches are recomputed. The
+# export always runs. Pipeline(cache_dir=None) or --no-cache turns it off.
+
+Stage = namedtuple("Stage", ["name", "inputs", "outputs", "settings", "modules"])
+
+# tools is in the modules of the stages that flag abnormal metrics, it holds
+# metrics_classes
+stages = [
+    Stage("ingest", [], ["training_count", "df_all"],
+          ["raw_path", "min_duration", "min_training_count", "teams"], ["ingest", "transforms"]),
+    Stage("order", ["df_all"], ["df_all", "combinations", "first_day", "last_day"],
+          ["seasons", "first_day", "last_day"], ["transforms"]),
+    Stage("calendar", ["df_all"], ["df_all"], ["seasons"], ["transforms"]),
+    Stage("aggregate", ["df_all"], ["df_week_player", "df_week_team"], [], ["transforms"]),
+    Stage("daily", ["df_all", "combinations", "first_day"], ["df_all", "ewma_state"],
+          ["imbalance_threshold", "high_acwr", "low_acwr"], ["transforms", "acwr", "tools"]),
+    Stage("weekly", ["df_week_player", "combinations", "first_day", "last_day"], ["df_week_player"],
+          ["imbalance_threshold", "high_acwr", "low_acwr"], ["transforms", "acwr", "tools"]),
+    Stage("team", ["df_week_team"], ["df_week_team"], [], ["transforms"]),
+    Stage("overview", ["df_all"], ["df_week_overview"], [], ["transforms"]),
+    Stage("team_summary", ["df_all"], ["df_team_day", "df_team_week", "df_week_player_max"], [], ["transforms"]),
+    Stage("rolling", ["df_all"], ["df_rolling"], ["rolling_min_periods"], ["transforms", "acwr"]),
+    Stage("week_dates", ["df_week_player", "df_week_team"], ["df_week_player", "df_week_team"],
+          ["seasons"], ["transforms"]),
+    Stage("export", ["df_all", "df_week_player", "df_week_team", "df_week_overview", "df_team_day",
+                     "df_team_week", "df_week_player_max", "df_rolling", "first_day", "last_day", "combinations", "training_count", "ewma_state"],
+          [], [], []),
+]
+stage_names = [stage.name for stage in stages]
+
+
+class Pipeline:
+    def __init__(self, raw_path="./data/anonymous.csv", data_dir=DATA_DIR, state_dir=STATE_DIR,
+                 seasons=seasons, first_day=None, last_day=None, teams=None,
+                 min_duration=MIN_DURATION, min_training_count=MIN_TRAINING_COUNT,
+                 imbalance_threshold=IMBA_THRES, high_acwr=HIGH_ACWR, low_acwr=LOW_ACWR,
+                 rolling_min_periods=ROLLING_MIN_PERIODS, workers=WORKERS,
+                 cache_dir=CACHE_DIR, cache_max_bytes=CACHE_MAX_BYTES):
+        # first_day and last_day default to the bounds of the seasons table;
+        # teams=None keeps every team
+        self.raw_path = raw_path
+        self.data_dir = data_dir
+        self.state_dir = state_dir
+        self.seasons = {label: tuple(days) for label, days in seasons.items()}
+        self.first_day = first_day
+        self.last_day = last_day
+        self.teams = list(teams) if teams is not None else None
+        self.min_duration = min_duration
+        self.min_training_count = min_training_count
+        self.imbalance_threshold = imbalance_threshold
+        self.high_acwr = high_acwr
+        self.low_acwr = low_acwr
+        self.rolling_min_periods = rolling_min_periods
+        self.workers = workers
+        self.cache = StageCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+    def settings(self):
+        # What incremental.py needs to rebuild or carry on the same tables
+        return {"seasons": self.seasons, "first_day": day_text(self.first_day), "last_day": day_text(self.last_day),
+                "teams": self.teams, "min_duration": self.min_duration,
+                "min_training_count": self.min_training_count,
+                "imbalance_threshold": self.imbalance_threshold,
+                "high_acwr": self.high_acwr, "low_acwr": self.low_acwr,
+                "rolling_min_periods": self.rolling_min_periods}
+
+    def run(self, only=None, skip=(), **results):
+        # Run the stages in order, `only` and `skip` pick some of them by
+        # name; results of stages left out can be passed in by name
+        unknown = set(only or []).union(skip).difference(stage_names)
+        if unknown:
+            raise ValueError(f"Unknown stages {sorted(unknown)}, the stages are {stage_names}")
+        if self.cache is None:
+            for stage in stages:
+                if (only is None or stage.name in only) and stage.name not in skip:
+                    results.update(self.run_stage(stage, results))
+            return results
+
+        # Results found in the cache stay on disk (name -> entry key) until a
+        # stage that runs needs them
+        hashes = {name: fingerprint(value) for name, value in results.items()}
+        cached = {}
+        for stage in stages:
+            if (only is not None and stage.name not in only) or stage.name in skip:
+                continue
+            check_inputs(stage, list(results) + list(cached))
+            if stage.outputs:
+                key = self.stage_key(stage, hashes)
+                hashes.update({name: fingerprint([key, name]) for name in stage.outputs})
+                if self.cache.has(key):
+                    for name in stage.outputs:
+                        results.pop(name, None)
+                        cached[name] = key
+                    continue
+            self.load_cached(stage.inputs, results, cached)
+            outputs = self.run_stage(stage, results)
+            if stage.outputs:
+                self.cache.save(key, outputs)
+            results.update(outputs)
+        self.load_cached(list(cached), results, cached)
+        self.cache.evict()
+        return results
+
+    def stage_key(self, stage, hashes):
+        # The raw export counts by its content, not its path
+        settings = {name: getattr(self, name) for name in stage.settings}
+        if "raw_path" in settings:
+            settings["raw_path"] = file_fingerprint(self.raw_path)
+        return fingerprint([stage.name, [hashes[name] for name in stage.inputs], settings,
+                            code_fingerprint(getattr(Pipeline, stage.name), stage.modules)])
+
+    def load_cached(self, names, results, cached):
+        for name in names:
+            if name in cached:
+                results[name] = self.cache.load(cached.pop(name), name)
+
+    def run_stage(self, stage, results):
+        check_inputs(stage, results)
+        outputs = getattr(self, stage.name)(*[results[name] for name in stage.inputs])
+        if len(stage.outputs) == 1:
+            outputs = (outputs,)
+        return dict(zip(stage.outputs, outputs or ()))
+
+    # %% stages
+
+    def ingest(self):
+        # remove training record < min_duration minutes
+        # and then remove players whose training count < min_training_count
+        # The raw export is streamed twice: session counts first, then the sessions
+        training_count = count_sessions(self.raw_path, min_duration=self.min_duration)
+        df_all = read_sessions(self.raw_path, training_count[training_count>=self.min_training_count].index,
+                               min_duration=self.min_duration, teams=self.teams)
+        return training_count, df_all
+
+    def order(self, df_all):
+        # Keep the sessions only, the date range sets the steps of the EWMA walk.
+        # A given last day cuts the sessions after it; the default end of the
+        # seasons grows with the exports appended by incremental.py
+        season_first_day, season_last_day = season_bounds(self.seasons)
+        first_day = pd.Timestamp(self.first_day or season_first_day)
+        if self.last_day:
+            last_day = pd.Timestamp(self.last_day)
+        else:
+            last_day = max(pd.Timestamp(season_last_day), df_all['Date'].max())
+
+        combinations = df_all[combination_columns].drop_duplicates()
+        df_all = order_sessions(combinations, df_all[(df_all['Date'] >= first_day) & (df_all['Date'] <= last_day)])
+        return df_all, combinations, first_day, last_day
+
+    def calendar(self, df_all):
+        # add season, weekday, week of year and year
+        return add_calendar(df_all, self.seasons)
+
+    def aggregate(self, df_all):
+        return aggregate_weeks(df_all)
+
+    def daily(self, df_all, combinations, first_day):
+        # intensity, IMA COD imbalance, EWMA ACWR, abnormal flags and risk scores
+        # Every step works per player, so the players are split into shards that
+        # run side by side (see parallel.py for the worker count).
+        # Rest days and weeks count as steps of the walk without an observation.
+        # The daily state is kept so incremental.py can carry on from the last day
+        shards = map_shards(enrich_daily, shard_frames(df_all, "Player", self.workers),
+                            (combinations, first_day) + self.thresholds(), self.workers)
+        ewma_state = concat_ewma_states([state for _, state in shards], pd.unique(df_all["Player"]))
+        return concat_shards([df for df, _ in shards], df_all.index), ewma_state
+
+    def weekly(self, df_week_player, combinations, first_day, last_day):
+        shards = map_shards(enrich_weekly, shard_frames(df_week_player, "Player", self.workers),
+                            (combinations, grid_weeks(first_day, last_day)) + self.thresholds(), self.workers)
+        return concat_shards(shards, df_week_player.index)
+
+    def team(self, df_week_team):
+        return get_training_intensity(df_week_team)
+
+    def overview(self, df_all):
+        # weekly team figures of the Overview page
+        return add_average_attendance(aggregate_overview_weeks(df_all))
+
+    def team_summary(self, df_all):
+        # daily and weekly team figures of the Team Daily Session page, and
+        # the weekly maxima of its players
+        df_team_day = aggregate_team_days(df_all)
+        return df_team_day, aggregate_team_weeks(df_team_day), aggregate_player_week_max(df_all)
+
+    def rolling(self, df_all):
+        # rolling 7:28 ACWR, monotony and strain, see acwr.calc_rolling_loads
+        return rolling_loads(df_all, self.rolling_min_periods)
+
+    def week_dates(self, df_week_player, df_week_team):
+        # add date to week player and team for filter
+        return add_week_dates(df_week_player, self.seasons), add_week_dates(df_week_team, self.seasons)
+
+    def export(self, df_all, df_week_player, df_week_team, df_week_overview, df_team_day, df_team_week,
+               df_week_player_max, df_rolling, first_day, last_day, combinations, training_count, ewma_state):
+        # export to the columnar store
+        write_table(df_all, "df_all", self.data_dir)
+        write_table(df_week_player, "df_week_player", self.data_dir)
+        write_table(df_week_team, "df_week_team", self.data_dir)
+        write_table(df_week_overview, "df_week_overview", self.data_dir)
+        write_table(df_team_day, "df_team_day", self.data_dir)
+        write_table(df_team_week, "df_team_week", self.data_dir)
+        write_table(df_week_player_max, "df_week_player_max", self.data_dir)
+        write_table(df_rolling, "df_rolling", self.data_dir)
+        save_state(first_day, last_day, df_all['Date'].max(), combinations, training_count, ewma_state, df_all,
+                   self.state_dir, self.settings())
+
+    def thresholds(self):
+        return (self.imbalance_threshold, self.high_acwr, self.low_acwr)
+
+
+def check_inputs(stage, available):
+    missing = [name for name in stage.inputs if name not in available]
+    if missing:
+        raise KeyError(f"Stage {stage.name} needs {missing}, run the stages that make them or pass them in")
+
+
+def day_text(day):
+    return None if day is None else str(pd.Timestamp(day).date())
+
+
+def parse_season(text):
+    # "2021/22:2021-07-01:2022-06-30" -> ("2021/22", ("2021-07-01", "2022-06-30"))
+    label, start, end = text.split(":")
+    return label, (start, end)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the derived tables from the raw GPS export")
+    parser.add_argument("--raw", default="./data/anonymous.csv", help="raw GPS export")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--state-dir", default=STATE_DIR)
+    parser.add_argument("--season", action="append", type=parse_season, metavar="LABEL:START:END",
+                        help="season of the seasons table, repeat for more (default: transforms.seasons)")
+    parser.add_argument("--first-day", help="first day of the date range (default: first day of the seasons)")
+    parser.add_argument("--last-day", help="last day of the date range (default: last day of the seasons)")
+    parser.add_argument("--teams", nargs="+", help="run on these teams only")
+    parser.add_argument("--min-duration", type=float, default=MIN_DURATION)
+    parser.add_argument("--min-training-count", type=int, default=MIN_TRAINING_COUNT)
+    parser.add_argument("--imbalance-threshold", type=float, default=IMBA_THRES)
+    parser.add_argument("--high-acwr", type=float, default=HIGH_ACWR)
+    parser.add_argument("--low-acwr", type=float, default=LOW_ACWR)
+    parser.add_argument("--rolling-min-periods", type=int, default=ROLLING_MIN_PERIODS,
+                        help="days with a session a rolling ACWR window needs")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--only", nargs="+", choices=stage_names, help="run these stages only")
+    parser.add_argument("--skip", nargs="+", choices=stage_names, default=[], help="leave these stages out")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--cache-max-mb", type=float, default=CACHE_MAX_BYTES / 2 ** 20)
+    parser.add_argument("--no-cache", action="store_true", help="run every stage without the stage cache")
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(args.raw, args.data_dir, args.state_dir, dict(args.season) if args.season else seasons,
+                        args.first_day, args.last_day, args.teams, args.min_duration, args.min_training_count,
+                        args.imbalance_threshold, args.high_acwr, args.low_acwr, args.rolling_min_periods, args.workers,
+                        None if args.no_cache else args.cache_dir, int(args.cache_max_mb * 2 ** 20))
+    return pipeline.run(args.only, args.skip)
+
+
+if __name__ == "__main__":
+    main()
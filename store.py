@@ -0,0 +1,147 @@
+import os
+import shutil
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from transforms import metrics, intensity_metrics
+
+# Columnar store of the derived tables. Each table is a Parquet dataset in
+# ./data/<name>/ partitioned by season and team, so a page reads only the
+# teams and columns it shows and gets its dtypes back without parsing.
+
+DATA_DIR = "./data"
+partition_columns = ["Season", "Team Name"]
+# Tables without a season column are partitioned by team only
+table_partitions = {
+    "df_week_overview": ["Team Name"],
+    "df_team_day": ["Team Name"],
+    "df_team_week": ["Team Name"],
+    "df_week_player_max": ["Team Name"],
+    "df_rolling": ["Team Name"],
+}
+
+# Declared schema of the stored tables, enforced on write and read.
+# Repeated labels are stored as dictionary columns and read as
+# categoricals, abnormal flag codes, risk scores and week numbers as int8.
+categorical_columns = ["Player", "Position", "Team Name", "Season", "Weekday", "IMA COD Deviation",
+                       "Year-Week", "IMA COD(Right) %", "IMA COD(Left) %"]
+int8_columns = ["Week"]
+
+# Columns of df_all whose values carry at most FLOAT32_DECIMALS decimals
+# (raw metrics, rounded ratios) and stay far below 65536 are stored as
+# float32. Rounding them back to float64 gives the original values, see
+# widen_floats. The weekly tables are small and keep float64.
+FLOAT32_DECIMALS = 2
+float32_columns = {
+    "df_all": ([metric for metric in metrics if metric != "Maximum Velocity(m/s)"] + intensity_metrics +
+               [f"{metric} EWMA ACWR" for metric in metrics + intensity_metrics] + ["IMA COD Imbalance"]),
+}
+
+# Row order of each table, restored after reading across partitions
+table_order = {
+    "df_all": ["Date"],
+    "df_week_player": ["Player", "Position", "Team Name", "Year", "Week"],
+    "df_week_team": ["Team Name", "Year", "Week"],
+    "df_week_overview": ["Team Name", "Year", "Week"],
+    "df_team_day": ["Team Name", "Date"],
+    "df_team_week": ["Team Name", "Date"],
+    "df_week_player_max": ["Team Name", "Date", "Player"],
+    "df_rolling": ["Date"],
+}
+
+
+def table_path(name, data_dir=DATA_DIR):
+    return os.path.join(data_dir, name)
+
+
+def is_categorical(column):
+    return column in categorical_columns
+
+
+def is_flag(column):
+    return column.startswith("is_") and column.endswith("_abnormal")
+
+
+def column_dtype(name, column):
+    if is_categorical(column):
+        return "category"
+    if column in int8_columns or column.endswith(" Risk Score") or is_flag(column):
+        return "int8"
+    if column in float32_columns.get(name, []):
+        return "float32"
+    return None
+
+
+def apply_schema(df, name):
+    dtypes = {column: column_dtype(name, column) for column in df.columns}
+    dtypes = {column: dtype for column, dtype in dtypes.items()
+              if dtype is not None and df[column].dtype != dtype}
+    return df.astype(dtypes) if dtypes else df
+
+
+def widen_floats(df, name):
+    # float32 columns back to float64 at their declared precision, for views
+    # handed to pages and charts
+    columns = [column for column in float32_columns.get(name, []) if column in df.columns]
+    if columns:
+        df[columns] = df[columns].astype("float64").round(FLOAT32_DECIMALS)
+    return df
+
+
+def to_arrow(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # One dictionary index width for every file, whatever the number of
+    # labels in a partition, so appended files share the dataset schema
+    for i, field in enumerate(table.schema):
+        if is_categorical(field.name):
+            column = table.column(i)
+            if not pa.types.is_dictionary(column.type):
+                column = column.dictionary_encode()
+            table = table.set_column(i, field.name, column.cast(pa.dictionary(pa.int32(), pa.string())))
+    return table
+
+
+def write_table(df, name, data_dir=DATA_DIR, append=False):
+    # A full write replaces the dataset, an append adds new files next to it
+    path = table_path(name, data_dir)
+    if not append and os.path.exists(path):
+        shutil.rmtree(path)
+    pq.write_to_dataset(to_arrow(apply_schema(df, name)), path, partition_cols=table_partitions.get(name, partition_columns),
+                        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                        existing_data_behavior="overwrite_or_ignore")
+
+
+def open_dataset(name, data_dir=DATA_DIR):
+    # Partition values are read as plain strings: arrow cannot yet merge
+    # dictionary partition columns holding nulls (weeks outside a season)
+    return ds.dataset(table_path(name, data_dir), format="parquet", partitioning="hive")
+
+
+def table_columns(name, data_dir=DATA_DIR):
+    return open_dataset(name, data_dir).schema.names
+
+
+def read_table(name, columns=None, filters=None, data_dir=DATA_DIR):
+    # filters: {column: value or list of values}; on partition columns whole
+    # files are skipped
+    expression = None
+    for column, value in (filters or {}).items():
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        condition = ds.field(column).isin(values)
+        expression = condition if expression is None else expression & condition
+
+    df = apply_schema(open_dataset(name, data_dir).to_table(columns=columns, filter=expression).to_pandas(), name)
+
+    order = [column for column in table_order.get(name, []) if column in df.columns]
+    if order:
+        df = df.sort_values(order, kind="stable", ignore_index=True, key=by_label)
+    return df
+
+
+def by_label(column):
+    # Sort categoricals by their labels rather than by category code
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.astype(str)
+    return column
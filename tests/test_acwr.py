@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from acwr import calc_ewma_acwr, calc_rolling_loads
+
+# calc_ewma_acwr against the per-player pandas ewm(adjust=True).mean() it
+# replaced, on a day grid of a few players with rest days and missing values,
+# and calc_rolling_loads against per-player pandas rolling windows
+
+metrics = ["Load", "Distance"]
+
+
+def day_grid(seed=0, players=3, days=90):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2023-01-01", periods=days)
+    # rows by date, the players interleaved like the pipeline's frames
+    df = pd.DataFrame({"Date": np.repeat(dates, players),
+                       "Player": np.tile([f"Player{i}" for i in range(players)], days)})
+    df["Day"] = (df["Date"] - dates[0]).dt.days
+    for metric in metrics:
+        df[metric] = rng.gamma(4.0, 50.0, len(df))
+    rest = rng.random(len(df)) < 0.35
+    df.loc[rest, metrics] = np.nan
+    # a session with one metric missing
+    df.loc[~rest & (rng.random(len(df)) < 0.05), "Distance"] = np.nan
+    return df, rest
+
+
+def pandas_acwr(df, acute_days, chronic_days):
+    acwr = {}
+    for metric in metrics:
+        acute = df.groupby("Player")[metric].transform(lambda x: x.ewm(span=acute_days, adjust=True).mean())
+        chronic = df.groupby("Player")[metric].transform(lambda x: x.ewm(span=chronic_days, adjust=True).mean())
+        acwr[f"{metric} EWMA ACWR"] = (acute / chronic).round(2)
+    return pd.DataFrame(acwr)
+
+
+def test_every_row_a_step():
+    df, _ = day_grid()
+    expected = pandas_acwr(df, 7, 21)
+    result = calc_ewma_acwr(df.copy(), metrics)
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+
+def test_steps_skip_rest_days():
+    df, rest = day_grid(seed=1)
+    expected = pandas_acwr(df, 7, 21)[~rest]
+    sessions = df[~rest].copy()
+    result = calc_ewma_acwr(sessions, metrics, steps=sessions["Day"].to_numpy())
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+
+def test_weekly_spans():
+    df, rest = day_grid(seed=2, days=40)
+    expected = pandas_acwr(df, 1, 3)[~rest]
+    sessions = df[~rest].copy()
+    result = calc_ewma_acwr(sessions, metrics, acute_days=1, chronic_days=3, steps=sessions["Day"].to_numpy())
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+
+def test_state_carries_on():
+    df, rest = day_grid(seed=3)
+    expected = pandas_acwr(df, 7, 21)[~rest]
+    sessions = df[~rest].copy()
+    state = {}
+    first = sessions[sessions["Day"] < 45].copy()
+    second = sessions[sessions["Day"] >= 45].copy()
+    first = calc_ewma_acwr(first, metrics, state=state, steps=first["Day"].to_numpy())
+    second = calc_ewma_acwr(second, metrics, state=state, steps=second["Day"].to_numpy())
+    result = pd.concat([first, second])
+    pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+
+def pandas_rolling(df, metric, acute_days=7, chronic_days=28, min_periods=3):
+    # Daily totals of every player on a day grid reaching chronic_days back
+    # from the first session, so the windows before it hold no load
+    figures = []
+    for player, sessions in df.groupby("Player"):
+        daily = sessions.groupby("Date")[metric].sum(min_count=1)
+        days = pd.date_range(daily.index.min() - pd.Timedelta(days=chronic_days), daily.index.max())
+        daily = daily.reindex(days)
+        load, observed = daily.fillna(0.0), daily.notna().astype(float)
+        acute, chronic = load.rolling(acute_days).sum(), load.rolling(chronic_days).sum()
+        acute_observed = observed.rolling(acute_days).sum()
+        chronic_observed = observed.rolling(chronic_days).sum()
+        monotony = (acute / acute_days) / load.rolling(acute_days).std()
+        figure = pd.DataFrame({
+            "Coupled ACWR": (acute / acute_days) / (chronic / chronic_days),
+            "Uncoupled ACWR": (acute / acute_days) / ((chronic - acute) / (chronic_days - acute_days)),
+            "Monotony": monotony,
+            "Strain": acute * monotony,
+        })
+        figure.loc[chronic_observed < min_periods, "Coupled ACWR"] = np.nan
+        figure.loc[chronic_observed - acute_observed < min_periods, "Uncoupled ACWR"] = np.nan
+        figure.loc[acute_observed < min_periods, ["Monotony", "Strain"]] = np.nan
+        figures.append(figure.round(2).add_prefix(f"{metric} ").assign(Player=player))
+    figures = pd.concat(figures).rename_axis("Date").reset_index()
+    return df[["Player", "Date"]].merge(figures, on=["Player", "Date"], how="left")
+
+
+def test_rolling_loads():
+    df, rest = day_grid(seed=4, days=120)
+    sessions = df[~rest].copy()
+    # a second row on some days, e.g. a player listed under two positions
+    sessions = pd.concat([sessions, sessions.sample(frac=0.1, random_state=0)]).sort_values("Date", kind="stable")
+    result = calc_rolling_loads(sessions.copy(), metrics).reset_index(drop=True)
+    for metric in metrics:
+        expected = pandas_rolling(sessions, metric)
+        columns = [column for column in expected.columns if column.startswith(metric)]
+        # pandas sums its windows in another order, a figure may round the other way
+        np.testing.assert_allclose(result[columns].to_numpy(), expected[columns].to_numpy(),
+                                   rtol=1e-6, atol=0.0100001)
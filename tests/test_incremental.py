@@ -0,0 +1,79 @@
+import os
+import pandas as pd
+import pytest
+from bench import write_synthetic_export
+from incremental import update
+from pipeline import Pipeline
+from store import read_table
+
+# An incremental update against a full rebuild over the same raw history,
+# on a synthetic export whose last session day comes in as a new export
+
+tables = {
+    "df_all": ["Date", "Player", "Position", "Team Name"],
+    "df_week_player": ["Player", "Position", "Team Name", "Year", "Week"],
+    "df_week_team": ["Team Name", "Year", "Week"],
+    "df_week_overview": ["Team Name", "Year", "Week"],
+    "df_team_day": ["Team Name", "Date"],
+    "df_team_week": ["Team Name", "Date"],
+    "df_week_player_max": ["Team Name", "Date", "Player"],
+    "df_rolling": ["Date", "Player", "Position", "Team Name"],
+}
+
+
+def split_export(tmp_path):
+    # The raw history without its last session day, and that day as an export
+    raw_path = str(tmp_path / "anonymous.csv")
+    seasons = write_synthetic_export(raw_path, 2, 12, 1, seed=3)
+    raw = pd.read_csv(raw_path, dtype=str)
+    dates = pd.to_datetime(raw["date"], format="%d/%m/%Y")
+    last_day = raw[dates == dates.max()]
+    export_path = str(tmp_path / "export.csv")
+    last_day.to_csv(export_path, index=False)
+    return raw, dates, export_path, seasons
+
+
+def build(tmp_path, name, raw, seasons):
+    data_dir = str(tmp_path / name)
+    os.makedirs(data_dir)
+    raw.to_csv(os.path.join(data_dir, "anonymous.csv"), index=False)
+    Pipeline(os.path.join(data_dir, "anonymous.csv"), data_dir, os.path.join(data_dir, "state"), seasons,
+             workers=1, cache_dir=None).run()
+    return data_dir
+
+
+def sorted_table(name, data_dir):
+    df = read_table(name, data_dir=data_dir)
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df.sort_values(tables[name], ignore_index=True)
+
+
+def test_update_matches_full_rebuild(tmp_path):
+    raw, dates, export_path, seasons = split_export(tmp_path)
+    incremental_dir = build(tmp_path, "incremental", raw[dates < dates.max()], seasons)
+    update(export_path, incremental_dir, os.path.join(incremental_dir, "state"))
+    full_dir = build(tmp_path, "full", raw, seasons)
+
+    for name in tables:
+        full = sorted_table(name, full_dir)
+        pd.testing.assert_frame_equal(sorted_table(name, incremental_dir)[full.columns], full, check_dtype=False)
+
+    # the export went into the raw history once, and a second run is refused
+    appended = pd.read_csv(os.path.join(incremental_dir, "anonymous.csv"), dtype=str)
+    expected = pd.concat([raw[dates < dates.max()], raw[dates == dates.max()]], ignore_index=True)
+    pd.testing.assert_frame_equal(appended, expected)
+    with pytest.raises(ValueError):
+        update(export_path, incremental_dir, os.path.join(incremental_dir, "state"))
+
+
+def test_export_with_other_columns(tmp_path):
+    raw, dates, export_path, seasons = split_export(tmp_path)
+    data_dir = build(tmp_path, "incremental", raw[dates < dates.max()], seasons)
+    export = pd.read_csv(export_path, dtype=str)
+    export[export.columns[::-1]].to_csv(export_path, index=False)
+    raw_size = os.path.getsize(os.path.join(data_dir, "anonymous.csv"))
+    with pytest.raises(ValueError):
+        update(export_path, data_dir, os.path.join(data_dir, "state"))
+    assert os.path.getsize(os.path.join(data_dir, "anonymous.csv")) == raw_size
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from tools import metrics_classes
+from acwr import calc_ewma_acwr
+from transforms import (metrics, intensity_metrics, combination_columns, abnormal_labels, flag_abnormal,
+                        order_sessions, daily_steps)
+
+# The int8 abnormal codes and the risk scores of flag_abnormal against the
+# label rules they replaced: High above 1.5, Low below 0.8, Moderate
+# otherwise, and a class scores one per High or Low metric. Then the daily
+# walk of order_sessions and daily_steps against the all-days grid it
+# replaced
+
+flag_metrics = metrics + intensity_metrics
+
+
+def acwr_frame(seed=0, rows=500):
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.uniform(0.0, 2.5, (rows, len(flag_metrics))), 2)
+    # the bounds themselves, a missing ACWR and a division by a zero load
+    values[rng.random(values.shape) < 0.1] = 0.8
+    values[rng.random(values.shape) < 0.1] = 1.5
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[rng.random(values.shape) < 0.02] = np.inf
+    return pd.DataFrame(values, columns=[f"{metric} EWMA ACWR" for metric in flag_metrics])
+
+
+def label_abnormal(df, metric):
+    acwr = df[f"{metric} EWMA ACWR"]
+    return pd.Series(np.select([acwr > 1.5, acwr < 0.8], ["High", "Low"], default="Moderate"), index=df.index)
+
+
+def test_codes_match_labels():
+    df = flag_abnormal(acwr_frame())
+    for metric in flag_metrics:
+        assert df[f"is_{metric}_abnormal"].dtype == np.int8
+        labels = abnormal_labels[df[f"is_{metric}_abnormal"].to_numpy()]
+        np.testing.assert_array_equal(labels, label_abnormal(df, metric).to_numpy())
+
+
+def test_risk_scores_match_labels():
+    df = flag_abnormal(acwr_frame(seed=1))
+    for metric_class, class_metrics in metrics_classes.items():
+        expected = sum((label_abnormal(df, metric) != "Moderate").astype(int) for metric in class_metrics)
+        np.testing.assert_array_equal(df[f"{metric_class} Risk Score"].to_numpy(), expected.to_numpy())
+
+
+def test_custom_bounds():
+    df = flag_abnormal(acwr_frame(seed=2), high=1.3, low=0.9)
+    acwr = df["Duration EWMA ACWR"]
+    expected = np.select([acwr > 1.3, acwr < 0.9], ["High", "Low"], default="Moderate")
+    np.testing.assert_array_equal(abnormal_labels[df["is_Duration_abnormal"].to_numpy()], expected)
+
+
+def test_sessions_walk_the_grid():
+    # A player moving between positions and teams has a grid row per
+    # combination every day; the grid is sorted on the date with a stable
+    # sort, so a day's rows keep combination order
+    rng = np.random.default_rng(3)
+    combinations = pd.DataFrame({"Player": ["Player1", "Player1", "Player2", "Player1"],
+                                 "Position": ["Winger", "Full Back", "Winger", "Winger"],
+                                 "Team Name": ["Team1", "Team1", "Team1", "Team2"]})
+    dates = pd.date_range("2023-01-01", periods=60)
+    grid = combinations.merge(pd.DataFrame({"Date": dates}), how="cross")
+    sessions = grid[rng.random(len(grid)) < 0.3].copy()
+    for metric in metrics:
+        sessions[metric] = rng.gamma(4.0, 50.0, len(sessions))
+
+    grid = grid.merge(sessions, on=["Date"] + combination_columns, how="left").sort_values("Date", kind="stable")
+    acute = grid.groupby("Player")["Duration"].transform(lambda x: x.ewm(span=7, adjust=True).mean())
+    chronic = grid.groupby("Player")["Duration"].transform(lambda x: x.ewm(span=21, adjust=True).mean())
+    expected = grid.assign(ACWR=(acute / chronic).round(2)).dropna(subset=["Duration"])
+
+    df = order_sessions(combinations, sessions)
+    df = calc_ewma_acwr(df, ["Duration"], steps=daily_steps(df, combinations, dates[0]))
+    pd.testing.assert_frame_equal(df[["Date"] + combination_columns].reset_index(drop=True),
+                                  expected[["Date"] + combination_columns].reset_index(drop=True))
+    np.testing.assert_array_equal(df["Duration EWMA ACWR"].to_numpy(), expected["ACWR"].to_numpy())
@@ -3,6 +3,10 @@ import pandas as pd
 import datetime
 import time
 import plotly.graph_objects as go
+from comments import add_comment
+from chart_cache import memoize_chart
+from downsample import MAX_CHART_POINTS, lttb, bucket_mean
+from instrument import timed
 
 
 metrics_classes = {
@@ -61,9 +65,16 @@ def info_box(color_box=(255, 75, 75), iconname="fas fa-balance-scale-right", sli
 
 
 
-def draw_acwr(plot_df, col):
-    plot_df = plot_df.dropna()
-    ewma_acwr = alt.Chart(plot_df).mark_line(point=alt.OverlayMarkDef(color="#FF7676"), color="#FA8072").encode(
+@timed("chart")
+@memoize_chart
+def draw_acwr(plot_df, col, max_points=MAX_CHART_POINTS):
+    # Only the plotted columns go into the chart, at most max_points per
+    # layer (None keeps every row), see downsample.py
+    plot_df = plot_df.dropna()[["Date", col, f"{col} EWMA ACWR"]]
+    line_df = lttb(plot_df, "Date", f"{col} EWMA ACWR", max_points)
+    bar_df = bucket_mean(plot_df, [col, f"{col} EWMA ACWR"], max_points)
+
+    ewma_acwr = alt.Chart(line_df).mark_line(point=alt.OverlayMarkDef(color="#FF7676"), color="#FA8072").encode(
     alt.X("Date"),
     alt.Y(f'{col} EWMA ACWR', axis=alt.Axis(title=f'{col} EWMA ACWR', titleColor='#FF7676')),
     alt.Tooltip(["Date:T", f"{col} EWMA ACWR", f"{col}:Q"])
@@ -79,7 +90,7 @@ def draw_acwr(plot_df, col):
         y='y:Q'
     )
         
-    chart = alt.Chart(plot_df).mark_bar(color="#0F52BA").encode(
+    chart = alt.Chart(bar_df).mark_bar(color="#0F52BA").encode(
         alt.X("Date:T", axis=alt.Axis(title="Date")),
         alt.Y(f"{col}:Q", axis=alt.Axis(title=f"{col}")),
         alt.Tooltip(["Date:T", f"{col}:Q", f"{col} EWMA ACWR"])
@@ -111,37 +122,44 @@ def draw_acwr(plot_df, col):
 def get_not_passed_metrics(df, metrics_classes):
     not_pass_metrics = {}
     for key, value in metrics_classes.items():
-        not_pass = [metric for metric in value if any(df[f"is_{metric}_abnormal"]!="Moderate")]
+        not_pass = [metric for metric in value if any(df[f"is_{metric}_abnormal"]!=0)]
         not_pass_metrics[key] = not_pass
     return not_pass_metrics
 
 
 
-def submit_comment(player_id,  text, user, comment_table):
-    ts = time.time()
-    now = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-    new_row = pd.DataFrame({'Player': [player_id], 'Timestamp': [now],'User':user, 'Comment': [text]})
-    comment_table = pd.concat([comment_table, new_row], ignore_index=True)
-    comment_table.to_csv("./data/player_weekly_review_comment.csv", encoding='utf-8', index=False)
+def comment_timestamp():
+    return datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
+
+def submit_comment(player_id,  text, user, board="player_weekly_review"):
+    add_comment(board, comment_timestamp(), user, text, player=player_id)
 
-def submit_team_comment(team, date, text, user, comment_table, path):
-    ts = time.time()
-    now = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
-    new_row = pd.DataFrame({'Team': [team], 'Date': [date], 
-                            'Timestamp': [now],'User':user, 'Comment': [text]})
-    comment_table = pd.concat([comment_table, new_row], ignore_index=True)
-    comment_table.to_csv(path, encoding='utf-8', index=False)
+def submit_team_comment(team, date, text, user, board="team_daily_training"):
+    add_comment(board, comment_timestamp(), user, text, team=team, date=date)
 
 
 
 def draw_acc_dec():
     pass
 
-def draw_ima_cod(player1):
+@timed("chart")
+@memoize_chart
+def draw_ima_cod(player1, max_points=MAX_CHART_POINTS):
     player1 = player1.dropna()
 
+    # Past max_points days the bars show the mean counts of a period and
+    # their shares, the imbalance line the points kept by LTTB
+    cod_columns = ['IMA COD(left)', 'IMA COD(right)']
+    bar_df = player1[['Date', 'IMA COD(Right) %', 'IMA COD(Left) %'] + cod_columns]
+    if max_points is not None and len(player1) > max_points:
+        bar_df = bucket_mean(player1, cod_columns, max_points)
+        total = bar_df['IMA COD(left)'] + bar_df['IMA COD(right)']
+        bar_df['IMA COD(Right) %'] = (bar_df['IMA COD(right)'] / total).apply(lambda x: f"{x:.2%}")
+        bar_df['IMA COD(Left) %'] = (bar_df['IMA COD(left)'] / total).apply(lambda x: f"{x:.2%}")
+    line_df = lttb(player1[['Date', 'IMA COD Imbalance']], 'Date', 'IMA COD Imbalance', max_points)
+
     # Melt the DataFrame to long format for Altair
-    df_melted = player1.melt(id_vars=['Player', 'Date', 'IMA COD(Right) %', 'IMA COD(Left) %', 'IMA COD Imbalance'], 
+    df_melted = bar_df.melt(id_vars=['Date', 'IMA COD(Right) %', 'IMA COD(Left) %'], 
                         value_vars=['IMA COD(left)', 'IMA COD(right)'], 
                         var_name='Type', 
                         value_name='Value').dropna()
@@ -165,7 +183,7 @@ def draw_ima_cod(player1):
     )
 
     # Create the line chart for IMA COD Imbalance
-    line_chart = alt.Chart(player1).mark_line(color='#FF7F3E').encode(
+    line_chart = alt.Chart(line_df).mark_line(color='#FF7F3E').encode(
         x='Date:T',
         y=alt.Y('IMA COD Imbalance:Q', axis=alt.Axis(title='IMA COD Imbalance', titleColor='#FF7F3E')),
         tooltip=[
@@ -200,20 +218,23 @@ def draw_ima_cod(player1):
     return combined_chart
 
 
-def team_individual_graph(filtered_df,filtered_df_week, metric):
+@timed("chart")
+@memoize_chart
+def team_individual_graph(filtered_df, week_max, metric, max_points=MAX_CHART_POINTS):
+    # week_max: the rows of df_week_player_max of the week, the players'
+    # weekly maxima of every metric
 
     temp_df = filtered_df[["Player", "Position", f"{metric}"]].dropna()
 
-    max_series = filtered_df_week.groupby(["Player"])[f"{metric}"].max()
-    max_series.name = f"Max {metric}"
-    max_series = max_series.reset_index()
-    max_series.rename(columns={'index': 'Player'}, inplace=True)
-
-    merged_df = temp_df.merge(max_series, on='Player', how='left')
+    merged_df = temp_df.merge(week_max[["Player", f"Max {metric}"]], on='Player', how='left')
     merged_df = merged_df.sort_values(by=metric, ascending=False)
 
     # Calculate the average Duration
     average_duration = merged_df[metric].mean()
+
+    # The bars of the top max_points rows, the average is over all of them
+    if max_points is not None:
+        merged_df = merged_df.head(max_points)
     
     # Create the bar chart for Duration
     bars = alt.Chart(merged_df).mark_bar().encode(
@@ -245,6 +266,8 @@ def team_individual_graph(filtered_df,filtered_df_week, metric):
 
     return combined_chart
 
+@timed("chart")
+@memoize_chart
 def create_sankey(df, date_range, column_name, node_positions=None, max_width=1000):
     # Filter DataFrame for the given date range
     start_date, end_date = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
@@ -252,29 +275,29 @@ def create_sankey(df, date_range, column_name, node_positions=None, max_width=10
     
     # Create a list of unique values in the specified column
     nodes = df_filtered[column_name].unique().tolist()
-    
-    # Initialize the Sankey diagram components
     node_labels = nodes
-    links = {'source': [], 'target': [], 'value': [], 'player': [], 'date': []}
-    
-    # Create the links for the Sankey diagram
-    previous_value = {}
-
-    for date, group in df_filtered.groupby('Date'):
-        current_value = group.set_index('Player')[column_name].to_dict()
-
-        if previous_value:
-            for player, value in current_value.items():
-                if player in previous_value and previous_value[player] != value:
-                    source_idx = nodes.index(previous_value[player])
-                    target_idx = nodes.index(value)
-                    links['source'].append(source_idx)
-                    links['target'].append(target_idx)
-                    links['value'].append(1)
-                    links['player'].append(player)
-                    links['date'].append(date.strftime('%Y-%m-%d'))
 
-        previous_value = current_value
+    # One value per player and day, then every day a player's value differs
+    # from their previous day
+    moves = df_filtered[['Player', 'Date', column_name]].drop_duplicates(['Player', 'Date'], keep='last')
+    moves = moves.sort_values(['Player', 'Date'], kind='stable')
+    values = moves[column_name].astype(object)
+    previous = values.groupby(moves['Player'].to_numpy()).shift()
+    changed = (previous.notna() & (previous != values)).to_numpy()
+
+    # Identical transitions become one link weighted by their count
+    links = pd.DataFrame({
+        'source': pd.Categorical(previous[changed], categories=nodes).codes,
+        'target': pd.Categorical(values[changed], categories=nodes).codes,
+        'player': moves['Player'].astype(str).to_numpy()[changed],
+        'date': moves['Date'].to_numpy()[changed],
+    })
+    links = links.groupby(['source', 'target']).agg(
+        value=('player', 'size'),
+        players=('player', lambda x: ', '.join(sorted(set(x)))),
+        first=('date', 'min'),
+        last=('date', 'max'),
+    ).reset_index()
 
     # Extract positions for each node, setting default None for unspecified positions
     node_x = [node_positions[value][0] if node_positions and value in node_positions else None for value in node_labels]
@@ -294,8 +317,10 @@ def create_sankey(df, date_range, column_name, node_positions=None, max_width=10
             source=links['source'],
             target=links['target'],
             value=links['value'],
-            customdata=list(zip(links['player'], links['date'])),
-            hovertemplate='Player: %{customdata[0]}<br>Date: %{customdata[1]}<extra></extra>'
+            customdata=list(zip(links['players'], links['first'].dt.strftime('%Y-%m-%d'),
+                                links['last'].dt.strftime('%Y-%m-%d'))),
+            hovertemplate='Movements: %{value}<br>Players: %{customdata[0]}<br>'
+                          'Date: %{customdata[1]} to %{customdata[2]}<extra></extra>'
         )
     ))
 
@@ -0,0 +1,329 @@
+import pandas as pd
+import numpy as np
+from acwr import calc_ewma_acwr, calc_rolling_loads
+from instrument import stage
+from tools import metrics_classes
+
+# Shared transformation steps of the pre-processing pipeline. Both the full
+# rebuild in pre_processing.py and the daily update in incremental.py run
+# their data through these functions so the two stay in step.
+
+# %% Pre-defined variables
+IMBA_THRES = 0.1
+
+# ACWR above HIGH_ACWR or below LOW_ACWR flags a metric as abnormal. The
+# is_{metric}_abnormal columns hold codes, abnormal_labels[code] is the label
+# to display
+HIGH_ACWR = 1.5
+LOW_ACWR = 0.8
+abnormal_labels = np.array(['Moderate', 'High', 'Low'])
+
+# Season -> (first day, last day). Add a line per new season: the date grid
+# and the season labels follow this table.
+seasons = {
+    "2021/22": ('2021-07-01', '2022-06-30'),
+    "2022/23": ('2022-07-01', '2023-06-30')
+}
+
+day_names = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], dtype=object)
+
+# Minimum session duration (minutes) and number of sessions per player
+MIN_DURATION = 15
+MIN_TRAINING_COUNT = 8
+
+# Rolling ACWR windows (days) and the days with a session a window needs
+ROLLING_ACUTE_DAYS = 7
+ROLLING_CHRONIC_DAYS = 28
+ROLLING_MIN_PERIODS = 3
+
+# Rename columns for reporting purpose
+report_columns = ['Date', 'Player', 'Position', 'Team Name', 'Duration',
+       'Total Distance(m)', 'Total Player Load', 'Acc 2m/s2 Total Effort',
+       'Acc 3m/s2 Total Effort', 'Dec 2m/s2 Total Effort',
+       'Dec 3m/s2 Total Effort', 'High Intensity Distance(m)',
+       'Sprint Distance(m)', 'Maximum Velocity(m/s)', 'IMA COD(left)',
+       'IMA COD(right)']
+
+# Columns of the raw GPS export, in report_columns order, and their dtypes
+raw_columns = ['date', 'player', 'position', 'team_name', 'duration', 'total_distance_m',
+               'total_player_load', 'acc_2m_s_s_total_efforts', 'acc_3m_s_s_total_efforts',
+               'dec_2m_s_s_total_efforts', 'dec_3m_s_s_total_efforts',
+               'high_intensity_distance_m_v5_v6_m', 'sprint_distance_m_m', 'maximum_velocity_km_h',
+               'ima_cod_left', 'ima_cod_right']
+raw_dtypes = {column: 'float64' for column in raw_columns[4:]}
+raw_dtypes.update({'date': 'str', 'player': 'category', 'position': 'category', 'team_name': 'category'})
+
+# List of metrics to plot
+metrics = ['Duration', 'Total Distance(m)', 'Total Player Load', 'Acc 2m/s2 Total Effort',
+           'Acc 3m/s2 Total Effort', 'Dec 2m/s2 Total Effort', 'Dec 3m/s2 Total Effort',
+           'High Intensity Distance(m)', 'Sprint Distance(m)', 'Maximum Velocity(m/s)',
+           'IMA COD(left)', 'IMA COD(right)']
+
+# metrics classification
+intensity_metrics = ['Load Per Minute', 'Distance Per Minute', 'Acc-Dec-COD Per Minute']
+
+# Weekly team figures of the Overview page: column -> aggregate over the
+# sessions of the week ('Player' becomes the attendance)
+overview_aggregates = {
+    'Duration': 'mean',
+    "Total Distance(m)": 'mean',
+    "Total Player Load": 'mean',
+    "High Intensity Distance(m)": 'max',
+    "Sprint Distance(m)": 'max',
+    'Player': 'nunique',
+    "Load Per Minute": 'mean',
+    "Distance Per Minute": 'mean',
+    "Acc-Dec-COD Per Minute": 'mean'
+}
+
+# Metrics of the team summaries of the Team Daily Session page
+team_summary_metrics = metrics + intensity_metrics
+
+# Load metrics of the rolling ACWR, monotony and strain
+rolling_metrics = ['Duration', 'Total Distance(m)', 'Total Player Load', 'High Intensity Distance(m)',
+                   'Sprint Distance(m)']
+
+combination_columns = ['Player', 'Position', 'Team Name']
+week_player_keys = ["Player", "Position", "Team Name", "Year", "Week", "Year-Week"]
+week_team_keys = ["Team Name", "Year", "Week", "Year-Week"]
+player_week_max_keys = ["Team Name", "Date", "Player"]
+
+
+# %% Tool functions
+
+def prepare_sessions(df, min_duration=MIN_DURATION):
+    # Rename the raw export columns and convert units
+    df = df.copy()
+    df.columns = report_columns
+    df = df[df["Duration"]>=min_duration]
+    # transfer km/h to m/s
+    df['Maximum Velocity(m/s)'] = df['Maximum Velocity(m/s)']/3.6
+    df['Date'] = pd.to_datetime(df['Date'], format='%d/%m/%Y')
+    return df
+
+
+def classify_abnormal(df, metric_names, high=HIGH_ACWR, low=LOW_ACWR):
+    # Code matrix (rows, metrics) of the ACWR classes, see abnormal_labels:
+    # High above `high`, Low below `low`, Moderate otherwise (and without ACWR)
+    code = {label: i for i, label in enumerate(abnormal_labels)}
+    acwr = df[[f'{metric} EWMA ACWR' for metric in metric_names]].to_numpy(dtype=float)
+    return np.select([acwr > high, acwr < low], [code['High'], code['Low']], default=code['Moderate']).astype(np.int8)
+
+def flag_abnormal(df, high=HIGH_ACWR, low=LOW_ACWR):
+    # find abnormal per player, then count the abnormal metrics of every
+    # metrics class in one product with a (metrics, classes) membership matrix
+    flag_metrics = metrics + intensity_metrics
+    codes = classify_abnormal(df, flag_metrics, high, low)
+    membership = np.array([[metric in class_metrics for class_metrics in metrics_classes.values()]
+                           for metric in flag_metrics], dtype=np.int8)
+    scores = (codes != 0).astype(np.int8) @ membership
+
+    df[[f'is_{metric}_abnormal' for metric in flag_metrics]] = codes
+    df[[f"{metric_class} Risk Score" for metric_class in metrics_classes]] = scores
+    return df
+
+
+def get_training_intensity(df):
+    df['Load Per Minute'] = (df["Total Player Load"] / df["Duration"]).round(2)
+    df["Distance Per Minute"] = (df["Total Distance(m)"] / df["Duration"]).round(2)
+    df["Acc-Dec-COD Per Minute"] = ((df['IMA COD(left)'] + df['IMA COD(right)'] +
+                                    df['Acc 2m/s2 Total Effort'] + df['Dec 2m/s2 Total Effort']
+                                    )/ df["Duration"]).round(2)
+    return df
+
+def get_imbalance(df, threshold=IMBA_THRES):
+    df["IMA COD Imbalance"] = ((df['IMA COD(left)'] - df['IMA COD(right)'])/df['IMA COD(left)']).round(2)
+    df["Is IMA Imbalance"] = df["IMA COD Imbalance"].abs() > threshold
+
+    conditions = [
+        (df["IMA COD Imbalance"] > 1.2),
+        (df["IMA COD Imbalance"] < 0.8),
+        (df["IMA COD Imbalance"] >= 0.8) & (df["IMA COD Imbalance"] <= 1.2)
+    ]
+    choices = ['Left', 'Right', 'Balance']
+    df["IMA COD Deviation"] = np.select(conditions, choices, default='Balance')
+    df["IMA COD(Right) %"] = (df['IMA COD(right)'] / (df['IMA COD(left)'] + df['IMA COD(right)'])).apply(lambda x: f"{x:.2%}")
+    df["IMA COD(Left) %"] = (df['IMA COD(left)'] / (df['IMA COD(left)'] + df['IMA COD(right)'])).apply(lambda x: f"{x:.2%}")
+    return df
+
+def order_sessions(combinations, sessions):
+    # Sessions of the known (Player, Position, Team Name) combinations ordered
+    # by date, a player's rows of the same day in combination order: the
+    # order of the old all-days grid with its empty days left out. The grid
+    # used to be sorted on the date with numpy's unstable sort, which put a
+    # day's rows of a player with several combinations in no set order, and
+    # the daily EWMA of those players walked them in that order
+    order = combinations[combination_columns].assign(Combination=np.arange(len(combinations)))
+    df = sessions.merge(order, on=combination_columns, how='inner')
+    for column in metrics:
+        df[column] = df[column].astype(float)
+    return df.sort_values(['Date', 'Combination'], kind='stable').drop(columns='Combination')
+
+def daily_steps(df, combinations, first_day):
+    # Step of each session in a walk over every day of every combination of
+    # its player: day number * combinations of the player + the combination's
+    # rank. Days without a session are the steps in between.
+    ranks = combinations[combination_columns].assign(
+        Rank=combinations.groupby('Player', sort=False).cumcount().to_numpy(),
+        Count=combinations.groupby('Player', sort=False)['Player'].transform('size').to_numpy())
+    keyed = df[combination_columns].astype(object).merge(ranks, on=combination_columns, how='left')
+    days = (df['Date'] - first_day).dt.days.to_numpy()
+    return days * keyed['Count'].to_numpy() + keyed['Rank'].to_numpy()
+
+def grid_weeks(first_day, last_day):
+    # Year * 100 + Week of every week between two days, in table order
+    dates = pd.Series(pd.date_range(first_day, last_day))
+    return np.unique(dates.dt.year.to_numpy() * 100 + dates.dt.isocalendar().week.to_numpy(dtype=np.int64))
+
+def weekly_steps(df_week, combinations, weeks):
+    # Step of each row in a walk over every week of every combination of its
+    # player, combination after combination in table (label) order
+    combinations = combinations[combination_columns].astype(object).sort_values(combination_columns)
+    combinations['Rank'] = combinations.groupby('Player', sort=False).cumcount()
+    keyed = df_week[combination_columns].astype(object).merge(combinations, on=combination_columns, how='left')
+    week = np.searchsorted(weeks, df_week['Year'].to_numpy(dtype=np.int64) * 100 + df_week['Week'].to_numpy(dtype=np.int64))
+    return keyed['Rank'].to_numpy() * len(weeks) + week
+
+
+# %% add season, weekday, week of year and year
+
+def season_bounds(seasons=seasons):
+    # First and last day covered by the seasons table
+    return (min(pd.Timestamp(start) for start, _ in seasons.values()),
+            max(pd.Timestamp(end) for _, end in seasons.values()))
+
+def get_season(dates, seasons=seasons):
+    # Season of every date by interval lookup, None outside the table
+    intervals = pd.IntervalIndex.from_arrays(pd.to_datetime([start for start, _ in seasons.values()]),
+                                             pd.to_datetime([end for _, end in seasons.values()]),
+                                             closed='both')
+    position = intervals.get_indexer(pd.DatetimeIndex(dates))
+    labels = np.array(list(seasons) + [None], dtype=object)
+    return labels[position]
+
+def get_year_week(year, week):
+    # 'YYYY-Www' labels, formatted once per distinct week
+    key = year.to_numpy(dtype=np.int64) * 100 + week.to_numpy(dtype=np.int64)
+    uniques, inverse = np.unique(key, return_inverse=True)
+    labels = np.array([f"{k // 100}-W{k % 100:02d}" for k in uniques], dtype=object)
+    return labels[inverse]
+
+def add_calendar(df, seasons=seasons):
+    df['Season'] = get_season(df['Date'], seasons)
+    df['Weekday'] = day_names[df['Date'].dt.dayofweek.to_numpy()]
+    df['Week'] = df['Date'].dt.isocalendar().week
+    df['Year'] = df['Date'].dt.year
+    df['Year-Week'] = get_year_week(df['Year'], df['Week'])
+    return df
+
+def aggregate_weeks(df):
+    df_week_player = df.groupby(week_player_keys)[metrics].mean().reset_index()
+    df_week_team = df.groupby(week_team_keys)[metrics].mean().reset_index()
+    return df_week_player, df_week_team
+
+def complete_rows(df):
+    # Rows without a missing value in any column
+    return df.notna().all(axis=1).to_numpy()
+
+def aggregate_overview_weeks(df, complete=None):
+    # One row per team and ISO week with the figures of the Overview page,
+    # dated like the page always has: the Monday after the week. Like the
+    # page, it counts the rows of df_all without a missing value in any
+    # column; `complete` marks them when df holds only some of the columns
+    df = df[complete_rows(df) if complete is None else complete]
+    df_week = df.groupby(['Team Name', 'Year', 'Week']).agg(overview_aggregates).rename(
+        columns={'Player': 'Attendance'}).reset_index().round(2)
+    df_week['Date'] = pd.to_datetime(df_week['Year'].astype(str) + df_week['Week'].astype(str) + '1',
+                                     format='%G%V%u') + pd.offsets.Week(weekday=0)
+    return df_week
+
+def add_average_attendance(df_week):
+    # Average weekly attendance of each team over the whole table
+    df_week['Avg Attendance'] = df_week.groupby('Team Name', observed=True)['Attendance'].transform('mean')
+    return df_week
+
+def week_start(dates):
+    # Monday of the week, or 1 January when that Monday is in the year
+    # before: the weeks of the Year-Week labels
+    monday = dates - pd.to_timedelta(dates.dt.dayofweek, unit='D')
+    return monday.where(monday.dt.year == dates.dt.year, dates.dt.to_period('Y').dt.start_time)
+
+def aggregate_team_days(df):
+    # One row per team and day with the attendance and the mean of every
+    # summary metric, over the complete rows the Team Daily Session page shows
+    df = df.dropna()
+    groups = df.groupby(['Team Name', 'Date'], observed=True)
+    df_day = groups[team_summary_metrics].mean()
+    df_day.insert(0, 'Attendance', groups.size())
+    df_day[['Weekday', 'Year-Week']] = groups[['Weekday', 'Year-Week']].first()
+    df_day = df_day.reset_index()
+    df_day['Week Start'] = week_start(df_day['Date'])
+    return df_day
+
+def aggregate_team_weeks(df_day):
+    # One row per team and week (Date: the week start) with the highest
+    # daily mean of every summary metric, the sessions and the training days
+    groups = df_day.groupby(['Team Name', 'Week Start'], observed=True)
+    df_week = groups[team_summary_metrics].max().add_prefix('Max Daily Avg ')
+    df_week.insert(0, 'Sessions', groups['Attendance'].sum())
+    df_week.insert(1, 'Days', groups.size())
+    return df_week.reset_index().rename(columns={'Week Start': 'Date'})
+
+def aggregate_player_week_max(df):
+    # One wide row per team, week (Date: the week start) and player with the
+    # player's highest value of every summary metric that week, over the
+    # complete rows like the team summaries
+    df = df.dropna()
+    groups = df.groupby(['Team Name', week_start(df['Date']).rename('Week Start'), 'Player'], observed=True)
+    df_max = groups[team_summary_metrics].max().add_prefix('Max ')
+    df_max.insert(0, 'Year-Week', groups['Year-Week'].first())
+    return df_max.reset_index().rename(columns={'Week Start': 'Date'})
+
+def rolling_loads(df, min_periods=ROLLING_MIN_PERIODS):
+    # Coupled and uncoupled 7:28 ACWR, monotony and strain of every session,
+    # kept out of df_all: the pages drop its rows with a missing value
+    df_rolling = df[['Date'] + combination_columns + rolling_metrics].copy()
+    df_rolling = calc_rolling_loads(df_rolling, rolling_metrics, ROLLING_ACUTE_DAYS, ROLLING_CHRONIC_DAYS,
+                                    min_periods)
+    return df_rolling.drop(columns=rolling_metrics)
+
+
+# %% per player steps, run on a shard of the players by parallel.py
+
+def enrich_daily(df, combinations, first_day, imbalance_threshold=IMBA_THRES, high=HIGH_ACWR, low=LOW_ACWR):
+    # Intensity, imbalance, ACWR and flags of the daily sessions, with the
+    # final EWMA state of the shard's players. Each step is an
+    # instrument.stage, timed by bench.py
+    with stage("intensity"):
+        df = get_training_intensity(df)
+    with stage("imbalance"):
+        df = get_imbalance(df, imbalance_threshold)
+    with stage("acwr"):
+        state = {}
+        df = calc_ewma_acwr(df, metrics + intensity_metrics, state=state,
+                            steps=daily_steps(df, combinations, first_day))
+    # the flags and the risk scores come out of the same step
+    with stage("flags_risk"):
+        df = flag_abnormal(df, high, low)
+    return df, state
+
+def enrich_weekly(df_week, combinations, weeks, imbalance_threshold=IMBA_THRES, high=HIGH_ACWR, low=LOW_ACWR):
+    df_week = get_training_intensity(df_week)
+    df_week = get_imbalance(df_week, imbalance_threshold)
+    df_week = calc_ewma_acwr(df_week, metrics + intensity_metrics, acute_days=1, chronic_days=3,
+                             steps=weekly_steps(df_week, combinations, weeks))
+    df_week = flag_abnormal(df_week, high, low)
+    return df_week
+
+
+# %% add date to week player and team for filter
+def year_week_to_date(year, week):
+    # Monday on or before 1 January, plus the week number in weeks
+    first_day_of_year = pd.to_datetime(np.asarray(year, dtype=np.int64) * 10000 + 101, format='%Y%m%d')
+    first_day_of_week = first_day_of_year - pd.to_timedelta(first_day_of_year.dayofweek, unit='D')
+    return first_day_of_week + pd.to_timedelta(np.asarray(week, dtype=np.int64) * 7, unit='D')
+
+def add_week_dates(df, seasons=seasons):
+    df['Date'] = year_week_to_date(df['Year'], df['Week'])
+    df['Season'] = get_season(df['Date'], seasons)
+    return df